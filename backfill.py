@@ -0,0 +1,73 @@
+import os
+import asyncio
+
+import discord
+
+from result_parser import parse_result, result_entry
+
+# Messages handled per storage write while backfilling
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "100"))
+# Settings key holding {channel_id: last backfilled message id}
+CHECKPOINT_KEY = "backfill_checkpoints"
+
+
+def channel_history(channel, after_id=None):
+    """A discord.py channel's messages, oldest first, starting after the given message ID."""
+    after = discord.Object(id=after_id) if after_id else None
+    return channel.history(limit=None, after=after, oldest_first=True)
+
+async def get_checkpoint(store, guild_id, channel_id):
+    """The last message ID already backfilled from a channel, or None."""
+    settings = await store.get_settings(guild_id)
+    return settings.get(CHECKPOINT_KEY, {}).get(str(channel_id))
+
+async def pages(messages, size):
+    """Group an async iterator of messages into lists of up to `size`."""
+    page = []
+    async for message in messages:
+        page.append(message)
+        if len(page) >= size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+async def backfill_channel(store, guild_id, channel_id, messages, page_size=BACKFILL_PAGE_SIZE, progress=None):
+    """Record every result in `messages`, an async iterator of messages oldest first.
+
+    Each page is parsed first, then written with a single store.merge_submissions()
+    call, which holds the guild lock only for that page so live submissions slot in
+    between pages. Results already on the leaderboard are left alone, as on_message
+    would, and so are archived puzzles. After each page its last message ID is saved
+    as the channel's checkpoint, so an interrupted run resumes from
+    channel_history(channel, get_checkpoint(...)).
+
+    `progress` is a dict updated in place (scanned, recorded, skipped) and returned.
+    """
+    if progress is None:
+        progress = {}
+    for key in ("scanned", "recorded", "skipped"):
+        progress.setdefault(key, 0)
+
+    async for page in pages(messages, page_size):
+        submissions = []
+        for message in page:
+            if getattr(message.author, "bot", False):
+                continue
+            result = parse_result(message.content)
+            if result:
+                entry = result_entry(result, message.author.display_name, message.created_at)
+                submissions.append((result.puzzle, str(message.author.id), entry))
+
+        recorded, skipped = await store.merge_submissions(guild_id, submissions)
+        progress["scanned"] += len(page)
+        progress["recorded"] += recorded
+        progress["skipped"] += skipped
+        checkpoints = dict((await store.get_settings(guild_id)).get(CHECKPOINT_KEY, {}))
+        checkpoints[str(channel_id)] = page[-1].id
+        await store.update_settings(guild_id, {CHECKPOINT_KEY: checkpoints})
+        # Let queued events run before the next page
+        await asyncio.sleep(0)
+
+    return progress
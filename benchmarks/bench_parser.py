@@ -0,0 +1,81 @@
+"""Parse throughput benchmark for result_parser.parse_result.
+
+Runs the parser over a corpus of real shared results and ordinary channel chatter
+(benchmarks/parser_corpus.json) and reports messages per second for each, next to
+the per-message regex code on_message used before the single-pass parser.
+
+    python benchmarks/bench_parser.py [--repeat N] [--json results.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from result_parser import parse_result
+
+CORPUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.json")
+
+
+def legacy_parse(content):
+    """The original inline parsing from on_message, kept as a reference point."""
+    match = re.search(r'Puzzle #(\d+)', content)
+    if match and re.search(r'[🟩🟦🟧🟨🟪]', content):
+        full_group_pattern = r'^(🟩{4}|🟦{4}|🟧{4}|🟨{4}|🟪{4})$'
+        connections_solved = sum(1 for line in content.splitlines() if re.match(full_group_pattern, line.strip()))
+        guesses = len([line for line in content.splitlines() if re.search(r'[🟩🟦🟧🟨🟪]', line)])
+        return str(match.group(1)), guesses, connections_solved
+    return None
+
+
+def check_agreement(messages):
+    """Make sure the benchmarked parser still gives the legacy answers before timing it."""
+    for content in messages:
+        result = parse_result(content)
+        new = (result.puzzle, result.guesses, result.connections_solved) if result else None
+        if new != legacy_parse(content):
+            raise SystemExit(f"Parser disagrees with legacy parsing on:\n{content}")
+
+
+def measure(parser, messages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content in messages:
+            parser(content)
+    elapsed = time.perf_counter() - start
+    return len(messages) * repeat / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="passes over the corpus per measurement")
+    parser.add_argument("--json", help="also write the numbers to this file")
+    args = parser.parse_args()
+
+    with open(CORPUS_FILE, encoding="utf-8") as f:
+        corpus = json.load(f)
+    check_agreement(corpus["results"] + corpus["chatter"])
+
+    report = {}
+    for name, messages in (("results", corpus["results"]), ("chatter", corpus["chatter"])):
+        report[name] = {
+            "messages": len(messages),
+            "parse_result_per_sec": round(measure(parse_result, messages, args.repeat)),
+            "legacy_per_sec": round(measure(legacy_parse, messages, args.repeat)),
+        }
+
+    for name, numbers in report.items():
+        speedup = numbers["parse_result_per_sec"] / numbers["legacy_per_sec"]
+        print(f"{name:8} parse_result: {numbers['parse_result_per_sec']:>10,} msg/s   "
+              f"legacy: {numbers['legacy_per_sec']:>10,} msg/s   ({speedup:.1f}x)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
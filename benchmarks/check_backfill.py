@@ -0,0 +1,161 @@
+"""Check backfill_channel() against a fake channel history, including cancel and resume.
+
+Builds a channel history of results (with repeat posts, chatter and bot messages),
+cancels a backfill part-way through, resumes it from the saved checkpoint and checks
+that the guild ends up with exactly the first result each player posted per puzzle,
+that streak state matches the results, that a second resume records nothing, and that
+the data reloads the same from storage. Runs against both storage backends.
+
+    python benchmarks/check_backfill.py [--messages N] [--page-size N]
+"""
+import os
+import sys
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import datetime
+import contextlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from loadtest import FakeMember, result_text
+from backfill import backfill_channel, get_checkpoint
+from result_parser import parse_result
+from indexes import streak_runs
+from storage import LeaderboardStore, create_backend
+
+GUILD_ID = 1
+CHANNEL_ID = 10
+
+
+class HistoryMessage:
+    def __init__(self, message_id, content, author, created_at):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.created_at = created_at
+
+
+def build_history(count, rng):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    members = [FakeMember(user) for user in range(1, 31)]
+    bot_user = FakeMember(999)
+    bot_user.bot = True
+    messages = []
+    for message_id in range(1, count + 1):
+        roll = rng.random()
+        if roll < 0.3:
+            content, author = "anyone else stuck on purple?", rng.choice(members)
+        elif roll < 0.35:
+            content, author = result_text(rng.randint(400, 500), rng), bot_user
+        else:
+            content, author = result_text(rng.randint(400, 500), rng), rng.choice(members)
+        messages.append(HistoryMessage(message_id, content, author, start + datetime.timedelta(minutes=message_id)))
+    return messages
+
+
+async def fake_history(messages, after_id=None):
+    """channel_history() stand-in: messages oldest first after `after_id`, yielding to the loop like an API page fetch."""
+    for message in messages:
+        if after_id is None or message.id > after_id:
+            await asyncio.sleep(0)
+            yield message
+
+
+def expected_results(messages):
+    """{(puzzle, user_id): message id} of the first result each player posted per puzzle."""
+    expected = {}
+    for message in messages:
+        result = parse_result(message.content)
+        if result and not message.author.bot:
+            expected.setdefault((result.puzzle, str(message.author.id)), message.id)
+    return expected
+
+
+async def check_backend(name, messages, page_size, cancel_after):
+    problems = []
+    store = LeaderboardStore(create_backend(name))
+    progress = {}
+    task = asyncio.ensure_future(
+        backfill_channel(store, GUILD_ID, CHANNEL_ID, fake_history(messages), page_size, progress)
+    )
+    while progress.get("scanned", 0) < cancel_after and not task.done():
+        await asyncio.sleep(0)
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    checkpoint = await get_checkpoint(store, GUILD_ID, CHANNEL_ID)
+    if checkpoint is None or checkpoint >= messages[-1].id:
+        problems.append(f"{name}: no mid-run checkpoint after cancelling (got {checkpoint})")
+    if checkpoint is not None and checkpoint % page_size:
+        problems.append(f"{name}: checkpoint {checkpoint} isn't on a page boundary")
+
+    resumed = await backfill_channel(store, GUILD_ID, CHANNEL_ID, fake_history(messages, checkpoint), page_size)
+    if resumed["scanned"] != len(messages) - (checkpoint or 0):
+        problems.append(f"{name}: resume scanned {resumed['scanned']} messages")
+    again = await backfill_channel(
+        store, GUILD_ID, CHANNEL_ID, fake_history(messages, await get_checkpoint(store, GUILD_ID, CHANNEL_ID)), page_size
+    )
+    if again["scanned"] or again["recorded"]:
+        problems.append(f"{name}: second resume did work: {again}")
+
+    expected = expected_results(messages)
+    leaderboard = await store.get_leaderboard(GUILD_ID)
+    recorded = {(puzzle, user_id) for puzzle, scores in leaderboard.items() for user_id in scores}
+    if recorded != set(expected):
+        problems.append(f"{name}: {len(recorded ^ set(expected))} results differ from the channel history")
+    for (puzzle, user_id), message_id in expected.items():
+        entry = leaderboard.get(puzzle, {}).get(user_id)
+        if entry and entry["timestamp"] != messages[message_id - 1].created_at.isoformat():
+            problems.append(f"{name}: puzzle {puzzle} for {user_id} isn't the first result posted")
+            break
+
+    streaks = await store.get_streaks(GUILD_ID)
+    for user_id in {user_id for _, user_id in expected}:
+        history = await store.user_history(GUILD_ID, user_id)
+        current, best = streak_runs(list(history.puzzles))
+        state = streaks.get(user_id)
+        if state != {"last_puzzle": history.puzzles[-1], "current": current, "best": best}:
+            problems.append(f"{name}: streak state for {user_id} is {state}, expected {current}/{best}")
+            break
+
+    store.close()
+    reloaded = LeaderboardStore(create_backend(name))
+    if await reloaded.get_leaderboard(GUILD_ID) != leaderboard:
+        problems.append(f"{name}: leaderboard reloads differently from storage")
+    reloaded.close()
+    return checkpoint, len(expected), problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    messages = build_history(args.messages, random.Random(1))
+    problems = []
+    for name in ("json", "sqlite"):
+        # Storage files go in the working directory
+        directory = tempfile.mkdtemp(prefix="connections-backfill-")
+        os.chdir(directory)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                checkpoint, results, found = asyncio.run(
+                    check_backend(name, messages, args.page_size, args.messages // 3)
+                )
+        finally:
+            os.chdir(ROOT)
+            shutil.rmtree(directory, ignore_errors=True)
+        problems.extend(found)
+        print(f"{name}: cancelled at message {checkpoint}, resumed, {results} results recorded")
+    if problems:
+        raise SystemExit("backfill check failed:\n" + "\n".join(problems))
+    print("backfill: OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Check fan_out() with send_with_rate_limit_handling against fake channels that answer 429s.
+
+Some channels are rate limited a few times before they accept the daily post, some
+never accept it, and some refuse it outright (403). Exits with an error if the sent and
+failed counts, the messages each channel received, or the concurrency limit are wrong.
+
+    python benchmarks/check_fanout.py [--guilds N] [--concurrency N]
+"""
+import os
+import sys
+import random
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from loadtest import FakeChannel, FakeGuild, FakeResponse
+from fanout import fan_out
+from outbound import send_with_rate_limit_handling, SEND_MAX_RETRIES
+
+
+class FlakyChannel(FakeChannel):
+    """A channel that answers its first sends with the given HTTP statuses, then accepts."""
+
+    def __init__(self, channel_id, statuses, in_flight):
+        super().__init__(channel_id, FakeGuild(channel_id), 0.01, 0, {"send_calls": 0, "messages_sent": 0})
+        self.statuses = list(statuses)
+        self.in_flight = in_flight
+        self.received = []
+
+    async def send(self, content=None, **kwargs):
+        import discord
+        self.in_flight["now"] += 1
+        self.in_flight["max"] = max(self.in_flight["max"], self.in_flight["now"])
+        try:
+            await asyncio.sleep(self.latency)
+            self.stats["send_calls"] += 1
+            if self.statuses:
+                status = self.statuses.pop(0)
+                raise discord.HTTPException(FakeResponse(status, 0.05), f"HTTP {status}")
+            self.received.append(content)
+        finally:
+            self.in_flight["now"] -= 1
+
+
+async def run(guilds, concurrency):
+    rng = random.Random(1)
+    in_flight = {"now": 0, "max": 0}
+    channels, expect_sent = [], set()
+    for index in range(guilds):
+        kind = rng.choice(("ok", "ok", "limited", "limited", "exhausted", "forbidden"))
+        if kind == "ok":
+            statuses = []
+        elif kind == "limited":
+            statuses = [429] * rng.randint(1, SEND_MAX_RETRIES - 1)
+        elif kind == "exhausted":
+            statuses = [429] * SEND_MAX_RETRIES
+        else:
+            statuses = [403]
+        channel = FlakyChannel(index, statuses, in_flight)
+        channels.append((kind, channel))
+        if kind in ("ok", "limited"):
+            expect_sent.add(channel.id)
+
+    deliveries = [(channel, f"Final leaderboard for guild {channel.id}") for _, channel in channels]
+    sent, failed, elapsed = await fan_out(deliveries, send_with_rate_limit_handling, concurrency)
+
+    problems = []
+    if (sent, failed) != (len(expect_sent), guilds - len(expect_sent)):
+        problems.append(f"expected {len(expect_sent)} sent / {guilds - len(expect_sent)} failed, got {sent} / {failed}")
+    for kind, channel in channels:
+        expected = [f"Final leaderboard for guild {channel.id}"] if channel.id in expect_sent else []
+        if channel.received != expected:
+            problems.append(f"{kind} channel {channel.id} received {channel.received}")
+        attempts = {"ok": 1, "forbidden": 1, "exhausted": SEND_MAX_RETRIES}.get(kind)
+        if attempts is not None and channel.stats["send_calls"] != attempts:
+            problems.append(f"{kind} channel {channel.id} was tried {channel.stats['send_calls']} times")
+    if in_flight["max"] > concurrency:
+        problems.append(f"{in_flight['max']} sends in flight, limit is {concurrency}")
+    return sent, failed, elapsed, in_flight["max"], problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=60)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    # send_with_rate_limit_handling logs every retry; keep that out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        sent, failed, elapsed, max_in_flight, problems = asyncio.run(run(args.guilds, args.concurrency))
+    if problems:
+        raise SystemExit("fan_out check failed:\n" + "\n".join(problems))
+    print(f"fan_out: {sent} sent, {failed} failed in {elapsed:.2f}s, at most {max_in_flight} sends in flight - OK")
+
+
+if __name__ == "__main__":
+    main()
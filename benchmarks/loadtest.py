@@ -0,0 +1,287 @@
+"""Load test: a puzzle-release burst across many guilds, driven through the real on_message.
+
+Builds fake guilds, #connections channels and members, optionally gives every guild some
+earlier puzzles, then replays a burst of synthetic results (plus chatter and repeat
+submissions) at the pace they would arrive after a puzzle is released. Each message is
+handled in its own task, as discord.py dispatches events. Storage lives in a temporary
+directory; channel.send() is faked with a fixed latency and, optionally, a 429 every
+Nth send.
+
+Reports handling throughput, p50/p99 handling latency (arrival to on_message returning),
+event loop lag, acknowledgement sends and storage bytes written (JSON storage only; for
+SQLite, the database's growth on disk).
+
+    python benchmarks/loadtest.py [--guilds N] [--users N] [--duration S] [--backend json|sqlite] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import shutil
+import argparse
+import tempfile
+import datetime
+import contextlib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+GRIDS = [
+    ["🟨🟨🟨🟨", "🟩🟩🟩🟩", "🟦🟦🟦🟦", "🟪🟪🟪🟪"],
+    ["🟨🟩🟨🟨", "🟨🟨🟨🟨", "🟩🟩🟩🟩", "🟦🟪🟦🟦", "🟦🟦🟦🟦", "🟪🟪🟪🟪"],
+    ["🟩🟦🟩🟩", "🟩🟩🟩🟩", "🟦🟦🟦🟦", "🟨🟨🟨🟨", "🟪🟪🟪🟪"],
+    ["🟨🟩🟨🟨", "🟨🟦🟨🟨", "🟩🟩🟩🟩", "🟦🟪🟦🟦", "🟦🟪🟦🟨"],
+]
+CHATTER = ["that purple group was brutal", "who else got the fish one?", "gm", "no spoilers pls"]
+
+
+# --- Fakes ---
+class FakeResponse:
+    def __init__(self, status, retry_after):
+        self.status = status
+        self.reason = "Too Many Requests"
+        self.headers = {"Retry-After": str(retry_after)}
+
+
+class FakeChannel:
+    """A #connections channel whose send() takes `latency` seconds and rate-limits every Nth call."""
+
+    def __init__(self, channel_id, guild, latency, rate_limit_every, stats):
+        self.id = channel_id
+        self.name = "connections"
+        self.guild = guild
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.stats = stats
+
+    async def send(self, content=None, **kwargs):
+        import discord
+        await asyncio.sleep(self.latency)
+        self.stats["send_calls"] += 1
+        if self.rate_limit_every and self.stats["send_calls"] % self.rate_limit_every == 0:
+            raise discord.HTTPException(FakeResponse(429, 0.05), "You are being rate limited.")
+        self.stats["messages_sent"] += 1
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.text_channels = []
+
+
+class FakeMember:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"player{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+
+
+class FakeMessage:
+    def __init__(self, message_id, content, author, channel, state):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.attachments = []
+        self.mentions = []
+        # process_commands builds a real commands.Context around the message
+        self._state = state
+
+
+def result_text(puzzle, rng):
+    return f"Connections\nPuzzle #{puzzle}\n" + "\n".join(rng.choice(GRIDS))
+
+
+# --- Workload ---
+def build_burst(args, channels, members, puzzle, rng):
+    """(arrival seconds, channel, author, content) for the burst, sorted by arrival.
+
+    Arrivals are front-loaded, as after a release: most results land in the first part
+    of the window.
+    """
+    events = []
+    for channel in channels:
+        for member in members[channel.id]:
+            if rng.random() < args.participation:
+                events.append((args.duration * rng.random() ** 2, channel, member, result_text(puzzle, rng)))
+                if rng.random() < args.repeat_rate:
+                    events.append((args.duration * rng.random(), channel, member, result_text(puzzle, rng)))
+            if rng.random() < args.chatter_rate:
+                events.append((args.duration * rng.random(), channel, member, rng.choice(CHATTER)))
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+async def preload_history(store, channels, members, puzzle, history, rng):
+    """Give each guild `history` earlier puzzles, written the same way !backfill would."""
+    from result_parser import parse_result, result_entry
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for channel in channels:
+        submissions = []
+        for earlier in range(puzzle - history, puzzle):
+            for member in members[channel.id]:
+                if rng.random() < 0.7:
+                    result = parse_result(result_text(earlier, rng))
+                    submissions.append((result.puzzle, str(member.id), result_entry(result, member.display_name, now)))
+        await store.merge_submissions(channel.guild.id, submissions)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def disk_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+async def sample_loop_lag(interval, samples):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+# --- Run ---
+async def run(args, bot_module, directory):
+    from metrics import STORAGE_BYTES
+    rng = random.Random(args.seed)
+    store = bot_module.store
+    # on_message and process_commands compare authors with the logged-in user
+    bot_module.bot._connection.user = FakeMember(1)
+
+    send_stats = {"send_calls": 0, "messages_sent": 0}
+    channels, members = [], {}
+    for index in range(args.guilds):
+        guild = FakeGuild(1000 + index)
+        channel = FakeChannel(5000 + index, guild, args.send_latency, args.rate_limit_every, send_stats)
+        guild.text_channels.append(channel)
+        channels.append(channel)
+        members[channel.id] = [FakeMember(100000 + index * args.users + user) for user in range(args.users)]
+
+    puzzle = 1000
+    if args.history:
+        await preload_history(store, channels, members, puzzle, args.history, rng)
+        # Compact the preloaded journals now, or their compaction lands in the middle of the burst
+        await asyncio.get_running_loop().run_in_executor(None, store.flush)
+    events = build_burst(args, channels, members, puzzle, rng)
+
+    bytes_before = STORAGE_BYTES.value(direction="write")
+    disk_before = disk_bytes(directory)
+    latencies, lag_samples = [], []
+    lag_task = asyncio.ensure_future(sample_loop_lag(args.lag_interval, lag_samples))
+
+    async def handle(arrival, message):
+        await bot_module.on_message(message)
+        latencies.append(time.perf_counter() - arrival)
+
+    tasks = []
+    start = time.perf_counter()
+    for message_id, (offset, channel, author, content) in enumerate(events):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        message = FakeMessage(message_id, content, author, channel, bot_module.bot._connection)
+        tasks.append(asyncio.ensure_future(handle(time.perf_counter(), message)))
+    await asyncio.gather(*tasks)
+    handled = time.perf_counter() - start
+
+    await bot_module.ack_queue.drain()
+    lag_task.cancel()
+    bytes_written = STORAGE_BYTES.value(direction="write") - bytes_before
+    # Fold the burst's journal records into snapshots, as a restart or compaction would
+    await asyncio.get_running_loop().run_in_executor(None, store.flush)
+
+    results = sum(1 for _, _, _, content in events if "Puzzle #" in content)
+    # STORAGE_BYTES only counts JSON file I/O; for SQLite, disk growth is the measure
+    counted = args.backend == "json"
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "json"},
+        "messages": len(events),
+        "results": results,
+        "guilds": args.guilds,
+        "handled_seconds": round(handled, 3),
+        "throughput_per_sec": round(len(events) / handled, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(max(latencies, default=0) * 1000, 2),
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(lag_samples, 0.50) * 1000, 2),
+            "p99": round(percentile(lag_samples, 0.99) * 1000, 2),
+            "max": round(max(lag_samples, default=0) * 1000, 2),
+        },
+        "ack_messages_sent": send_stats["messages_sent"],
+        "ack_send_calls": send_stats["send_calls"],
+        "ack_dropped": bot_module.ack_queue.dropped,
+        "storage_bytes_written": bytes_written if counted else None,
+        "storage_bytes_flushed": STORAGE_BYTES.value(direction="write") - bytes_before - bytes_written if counted else None,
+        "disk_bytes_growth": disk_bytes(directory) - disk_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--users", type=int, default=25, help="members per guild")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds the burst is spread over")
+    parser.add_argument("--participation", type=float, default=0.8, help="share of members posting a result")
+    parser.add_argument("--repeat-rate", type=float, default=0.05, help="share of players who post twice")
+    parser.add_argument("--chatter-rate", type=float, default=0.3, help="chat messages per member")
+    parser.add_argument("--history", type=int, default=30, help="earlier puzzles preloaded per guild")
+    parser.add_argument("--send-latency", type=float, default=0.05, help="seconds each fake send takes")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="answer every Nth send with a 429")
+    parser.add_argument("--lag-interval", type=float, default=0.02, help="event loop lag sampling interval")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the numbers to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # Storage files go in the working directory
+    directory = tempfile.mkdtemp(prefix="connections-loadtest-")
+    os.chdir(directory)
+    import bot as bot_module
+    from storage import create_backend
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        bot_module.create_bot(create_backend(args.backend))
+
+    # on_message logs every submission; keep that out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        report = asyncio.run(run(args, bot_module, directory))
+    bot_module.store.close()
+    os.chdir(ROOT)
+    shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{report['messages']:,} messages ({report['results']:,} results) across {report['guilds']} guilds "
+          f"in {report['handled_seconds']}s with the {args.backend} backend")
+    print(f"throughput:  {report['throughput_per_sec']:,} msg/s")
+    print(f"latency:     p50 {report['latency_ms']['p50']} ms   p99 {report['latency_ms']['p99']} ms   "
+          f"max {report['latency_ms']['max']} ms")
+    print(f"loop lag:    p50 {report['loop_lag_ms']['p50']} ms   p99 {report['loop_lag_ms']['p99']} ms   "
+          f"max {report['loop_lag_ms']['max']} ms")
+    print(f"acks:        {report['ack_messages_sent']:,} messages sent, {report['ack_dropped']} dropped")
+    if report["storage_bytes_written"] is not None:
+        print(f"storage:     {report['storage_bytes_written']:,} bytes written during the burst, "
+              f"{report['storage_bytes_flushed']:,} flushing afterwards, disk grew {report['disk_bytes_growth']:,} bytes")
+    else:
+        print(f"storage:     disk grew {report['disk_bytes_growth']:,} bytes")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
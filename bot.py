@@ -1,164 +1,101 @@
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 import datetime
-import re
 import os
-import json
 from dotenv import load_dotenv
-from keep_alive import keep_alive
-import threading
-import glob
+from keep_alive import start_web_server, set_health_check
+from indexes import WEEKLY_MISSED_PENALTY, guild_timezone, month_puzzle_range, streak_runs
+from result_parser import INCOMPLETE_PENALTY, parse_result, result_entry
+from fanout import fan_out
+from backfill import backfill_channel, channel_history, get_checkpoint
+from export import export_guild, import_guild
+from outbound import OutboundQueue, send_with_rate_limit_handling, pack_lines
+from sharding import shard_config_from_env
+from scheduler import DailyScheduler, guild_post_time, parse_post_time
+from rendering import RenderCache, render_daily, render_weekly, render_combined, render_range, render_stats, render_history
+from metrics import (
+    Gauge,
+    PARSE_SECONDS,
+    ACK_QUEUE_DEPTH,
+    EVENT_LOOP_LAG,
+    DAILY_POST_SECONDS,
+    DAILY_POST_GUILDS,
+    STARTUP_SECONDS,
+    monitor_event_loop,
+)
+from storage import (
+    LeaderboardStore,
+    RETENTION_PUZZLES,
+    MIN_RETENTION_PUZZLES,
+)
+import math
+import time
+import tempfile
+import typing
 import asyncio
-
-# Load environment variables
-load_dotenv()
-
-# Start the web server to keep the bot alive
-keep_alive()
-
-# --- Bot Setup ---
-intents = discord.Intents.default()
-intents.messages = True
-intents.guilds = True
-intents.message_content = True  # Needed to read messages
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# --- Leaderboard Storage ---
-def get_leaderboard_file(guild_id):
-    return f"leaderboard_{guild_id}.json"
-
-def get_streaks_file(guild_id):
-    return f"streaks_{guild_id}.json"
-
-def load_leaderboard(guild_id):
-    file = get_leaderboard_file(guild_id)
-    if os.path.exists(file):
-        with open(file, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_leaderboard(guild_id, data):
-    file = get_leaderboard_file(guild_id)
-    with open(file, "w") as f:
-        json.dump(data, f, indent=2)
-
-def load_streaks(guild_id):
-    file = get_streaks_file(guild_id)
-    if os.path.exists(file):
-        with open(file, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_streaks(guild_id, data):
-    file = get_streaks_file(guild_id)
-    with open(file, "w") as f:
-        json.dump(data, f, indent=2)
-
-def calculate_user_streak(guild_id, user_id, current_puzzle):
-    """Calculate the current consecutive daily streak for a user."""
-    leaderboard = load_leaderboard(guild_id)
-    
-    if not leaderboard:
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# --- App State ---
+# Built by create_bot(); importing this module doesn't connect, load or start anything
+bot = None
+# All reads and writes go through the in-memory store; STORAGE_BACKEND picks json or sqlite
+store = None
+# Rendered leaderboard text, reused until the guild's next submission
+render_cache = None
+# Acknowledgements are batched per channel; everything else is sent directly
+ack_queue = None
+scheduler = None
+
+async def calculate_user_streak(guild_id, user_id, current_puzzle):
+    """The user's run of consecutive puzzles ending at current_puzzle, carried on from their archived puzzles."""
+    history = await store.user_history(guild_id, user_id)
+    current_puzzle = int(current_puzzle)
+    played = [puzzle_num for puzzle_num in history.puzzles if puzzle_num <= current_puzzle] if history else []
+    if not played or played[-1] != current_puzzle:
         return 0
-    
-    # Get all puzzle numbers the user has participated in, sorted
-    user_puzzles = []
-    for puzzle_num, puzzle_data in leaderboard.items():
-        if user_id in puzzle_data:
-            user_puzzles.append(int(puzzle_num))
-    
-    if not user_puzzles:
-        return 0
-    
-    user_puzzles.sort(reverse=True)  # Most recent first
-    current_puzzle_int = int(current_puzzle)
-    
-    # Start with current puzzle and count consecutive days backwards
-    streak = 0
-    expected_puzzle = current_puzzle_int
-    
-    for puzzle_num in user_puzzles:
-        if puzzle_num == expected_puzzle:
-            streak += 1
-            expected_puzzle -= 1
-        elif puzzle_num < expected_puzzle:
-            # We've found a gap, stop counting
-            break
-    
-    return streak
-
-def has_results_from_today(leaderboard, today_date):
-    """Check if any puzzle has results submitted today."""
-    for puzzle_key, scores in leaderboard.items():
-        for user_id, entry in scores.items():
-            # Check if this entry has a timestamp from today
-            if 'timestamp' in entry:
-                try:
-                    entry_date = datetime.datetime.fromisoformat(entry['timestamp']).date()
-                    if entry_date == today_date:
-                        return puzzle_key
-                except (ValueError, TypeError):
-                    # If timestamp is malformed, skip this entry
-                    continue
-    return None
-
-def get_latest_puzzle_from_today(leaderboard, today_date):
-    """Get the latest puzzle number that has results from today."""
-    today_puzzles = []
-    for puzzle_key, scores in leaderboard.items():
-        has_today_result = False
-        for user_id, entry in scores.items():
-            if 'timestamp' in entry:
-                try:
-                    entry_date = datetime.datetime.fromisoformat(entry['timestamp']).date()
-                    if entry_date == today_date:
-                        has_today_result = True
-                        break
-                except (ValueError, TypeError):
-                    continue
-        if has_today_result:
-            today_puzzles.append(int(puzzle_key))
-    
-    return str(max(today_puzzles)) if today_puzzles else None
+    return streak_runs(played, history.summary)[0]
 
-def update_user_streak(guild_id, user_id, current_puzzle):
-    """Update and return the user's current streak."""
-    streaks = load_streaks(guild_id)
+async def rebuild_streak_state(guild_id, user_id):
+    """Build a user's streak state from their full history, archive included (as !stats does)."""
+    history = await store.user_history(guild_id, user_id)
+    if history is None or not history.puzzles:
+        return None
+    current, best = history.streaks()
+    return {"last_puzzle": history.puzzles[-1], "current": current, "best": best}
+
+async def update_user_streak(guild_id, user_id, current_puzzle):
+    """Fold a newly recorded puzzle into the user's streak state and return the streak ending at it.
+
+    Streak state is {"last_puzzle", "current", "best"}, so the usual case (the next
+    puzzle, or a gap) is O(1). Backfilled puzzles older than last_puzzle can join or
+    split runs, so they fall back to rebuilding from history.
+    """
+    streaks = await store.get_streaks(guild_id)
+    state = streaks.get(user_id)
+    puzzle = int(current_puzzle)
     
-    # Calculate the new streak
-    new_streak = calculate_user_streak(guild_id, user_id, current_puzzle)
+    if not isinstance(state, dict):
+        # First use, or an old-format integer streak: seed from history (which already holds this puzzle)
+        state = await rebuild_streak_state(guild_id, user_id)
+        new_streak = await calculate_user_streak(guild_id, user_id, puzzle)
+    elif puzzle > state["last_puzzle"]:
+        state = dict(state)
+        state["current"] = state["current"] + 1 if puzzle == state["last_puzzle"] + 1 else 1
+        state["last_puzzle"] = puzzle
+        state["best"] = max(state["best"], state["current"])
+        new_streak = state["current"]
+    elif puzzle < state["last_puzzle"]:
+        state = await rebuild_streak_state(guild_id, user_id)
+        new_streak = await calculate_user_streak(guild_id, user_id, puzzle)
+    else:
+        new_streak = state["current"]
     
     # Update the stored streak
-    streaks[user_id] = new_streak
-    save_streaks(guild_id, streaks)
+    await store.set_streak(guild_id, user_id, state)
     
     return new_streak
 
 # --- Auto-detect NYT Connections results ---
-leaderboard_lock = threading.Lock()
-
-async def send_with_rate_limit_handling(channel, message, max_retries=3):
-    """Send a message to a channel with rate limit handling and retries."""
-    for attempt in range(max_retries):
-        try:
-            await channel.send(message)
-            return True
-        except discord.HTTPException as e:
-            if e.status == 429:  # Rate limited
-                retry_after = float(e.response.headers.get('Retry-After', 1))
-                print(f"Rate limited, waiting {retry_after} seconds before retry {attempt + 1}/{max_retries}")
-                await asyncio.sleep(retry_after)
-            else:
-                print(f"HTTP error sending message: {e}")
-                return False
-        except Exception as e:
-            print(f"Unexpected error sending message: {e}")
-            return False
-    
-    print(f"Failed to send message after {max_retries} attempts")
-    return False
-
-@bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
@@ -168,62 +105,64 @@ async def on_message(message):
         return
 
     guild_id = message.guild.id
-    leaderboard = load_leaderboard(guild_id)
 
-    # Detect puzzle number
-    match = re.search(r'Puzzle #(\d+)', message.content)
-    if match and re.search(r'[🟩🟦🟧🟨🟪]', message.content):
-        puzzle = str(match.group(1))
+    # Detect a shared result (puzzle number, guess rows and solved groups in one pass)
+    with PARSE_SECONDS.time():
+        result = parse_result(message.content)
+    if result:
+        puzzle = result.puzzle
         user_id = str(message.author.id)
         user_name = message.author.display_name
 
-        # Only record the first submission for each user per puzzle
-        leaderboard.setdefault(puzzle, {})
-        if user_id in leaderboard[puzzle]:
-            await send_with_rate_limit_handling(
+        # Guesses = number of lines containing squares
+        guesses = result.guesses
+        connections_solved = result.connections_solved
+        
+        # Check if puzzle is complete (4 connections solved)
+        is_complete = result.is_complete
+        
+        if is_complete:
+            # Complete puzzle: use normal scoring
+            status_text = f"({guesses} guesses)"
+        else:
+            # Incomplete puzzle: penalty score and mark as failed
+            status_text = f"(❌ INCOMPLETE - {connections_solved}/4 connections, penalty score: {INCOMPLETE_PENALTY})"
+        
+        # Check-then-record under the guild lock so two quick submissions can't both count
+        async with store.lock(guild_id):
+            leaderboard = await store.get_leaderboard(guild_id)
+            indexes = await store.guild_indexes(guild_id)
+            
+            # Only record the first submission for each user per puzzle
+            already_submitted = user_id in leaderboard.get(puzzle, {})
+            # Puzzles rolled into the archive can't take new results
+            archived = int(puzzle) < indexes.archived_before()
+            if not already_submitted and not archived:
+                await store.record_submission(guild_id, puzzle, user_id, result_entry(
+                    result, user_name, datetime.datetime.now(datetime.timezone.utc)
+                ))
+                
+                # Calculate and update user's daily streak
+                current_streak = await update_user_streak(guild_id, user_id, puzzle)
+        
+        if archived and not already_submitted:
+            ack_queue.enqueue(
+                message.channel,
+                f"⚠️ {user_name}, Puzzle #{puzzle} has been archived, so new results for it can't be recorded."
+            )
+        elif already_submitted:
+            ack_queue.enqueue(
                 message.channel,
                 f"⚠️ {user_name}, you've already submitted a result for Puzzle #{puzzle}. Only your first submission counts."
             )
         else:
-            # Count guesses = number of lines containing squares
-            full_group_pattern = r'^(🟩{4}|🟦{4}|🟧{4}|🟨{4}|🟪{4})$'
-            connections_solved = sum(1 for line in message.content.splitlines() if re.match(full_group_pattern, line.strip()))
-            guesses = len([line for line in message.content.splitlines() if re.search(r'[🟩🟦🟧🟨🟪]', line)])
-            
-            # Check if puzzle is complete (4 connections solved)
-            is_complete = connections_solved >= 4
-            
-            if is_complete:
-                # Complete puzzle: use normal scoring
-                final_score = guesses
-                status = "complete"
-                status_text = f"({guesses} guesses)"
-            else:
-                # Incomplete puzzle: penalty score of 10 and mark as failed
-                final_score = 10
-                status = "incomplete"
-                status_text = f"(❌ INCOMPLETE - {connections_solved}/4 connections, penalty score: 10)"
-            
-            leaderboard[puzzle][user_id] = {
-                "name": user_name, 
-                "guesses": final_score,
-                "status": status,
-                "connections_solved": connections_solved,
-                "actual_guesses": guesses,
-                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
-            }
-            save_leaderboard(guild_id, leaderboard)
-            
-            # Calculate and update user's daily streak
-            current_streak = update_user_streak(guild_id, user_id, puzzle)
-            
             # Create streak display with fire emoji
             streak_text = ""
             if current_streak > 0:
                 streak_text = f" 🔥 {current_streak} day streak!"
             
             print(f"Saved submission for {user_name} (Puzzle {puzzle}, {status_text})")
-            await send_with_rate_limit_handling(
+            ack_queue.enqueue(
                 message.channel,
                 f"✅ Recorded {user_name}'s result for Puzzle #{puzzle} {status_text}{streak_text}"
             )
@@ -231,16 +170,21 @@ async def on_message(message):
     await bot.process_commands(message)
 
 # --- Command: Leaderboard ---
-@bot.command(name="leaderboard")
-async def leaderboard_cmd(ctx, puzzle_number: str):
+@commands.command(name="leaderboard")
+async def leaderboard_cmd(ctx, puzzle_number: str, *args):
     guild_id = ctx.guild.id
-    leaderboard = load_leaderboard(guild_id)
+    if puzzle_number.lower() in ("range", "month", "all"):
+        await send_range_leaderboard(ctx, puzzle_number.lower(), args)
+        return
+
+    leaderboard = await store.get_leaderboard(guild_id)
 
     if puzzle_number.lower() == "today":
-        if not leaderboard:
+        indexes = await store.guild_indexes(guild_id)
+        if not indexes.puzzle_numbers:
             await send_with_rate_limit_handling(ctx.channel, "No puzzles have been recorded yet.")
             return
-        puzzle_key = max(leaderboard.keys(), key=lambda k: int(k))  # latest puzzle
+        puzzle_key = str(indexes.puzzle_numbers[-1])  # latest puzzle
     else:
         puzzle_key = puzzle_number
 
@@ -249,176 +193,86 @@ async def leaderboard_cmd(ctx, puzzle_number: str):
         return
 
     scores = leaderboard[puzzle_key]
-    sorted_scores = sorted(scores.values(), key=lambda x: x["guesses"])
+    msg = render_cache.get_or_render(
+        guild_id, store.version(guild_id), ("daily", puzzle_key),
+        lambda: render_daily(puzzle_key, scores)
+    )
 
-    msg = f"🏆 Leaderboard for Puzzle #{puzzle_key} 🏆\n"
+    await send_with_rate_limit_handling(ctx.channel, msg)
 
-    medals = ["🥇", "🥈", "🥉"]
-    current_rank = 1
-    prev_guesses = None
-    
-    for idx, entry in enumerate(sorted_scores):
-        # Handle ties - players with same score get same rank
-        if prev_guesses is not None and entry['guesses'] != prev_guesses:
-            current_rank = idx + 1
-        
-        # Handle both old and new data formats for backward compatibility
-        if 'status' in entry:
-            if entry['status'] == 'complete':
-                medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-                status_display = f"{entry['guesses']} guesses"
+RANGE_USAGE = "Usage: `!leaderboard range <from> <to>`, `!leaderboard month [YYYY-MM]` or `!leaderboard all`"
+
+async def send_range_leaderboard(ctx, view, args):
+    """Standings over a puzzle range, a calendar month (in the guild's timezone) or all time."""
+    guild_id = ctx.guild.id
+    try:
+        if view == "range":
+            if len(args) != 2:
+                raise ValueError(view)
+            first, last = sorted(int(arg.lstrip("#")) for arg in args)
+            title = "Leaderboard"
+            empty = f"No results between Puzzle #{first} and #{last}."
+        elif view == "month":
+            if args:
+                month = datetime.datetime.strptime(args[0], "%Y-%m").date()
             else:
-                medal = "💀"  # Skull emoji for incomplete puzzles
-                status_display = f"❌ INCOMPLETE ({entry.get('connections_solved', 0)}/4)"
+                month = datetime.datetime.now(guild_timezone(await store.get_settings(guild_id))).date()
+            first, last = month_puzzle_range(month.year, month.month)
+            title = f"Monthly Leaderboard for {month.strftime('%B %Y')}"
+            empty = f"No results for {month.strftime('%B %Y')}."
         else:
-            # Old format - assume complete if no status field
-            medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-            status_display = f"{entry['guesses']} guesses"
-        
-        msg += f"{medal} {entry['name']}: {status_display}\n"
-        prev_guesses = entry['guesses']
+            first, last = 1, 2 ** 32 - 1
+            title = "All-Time Leaderboard"
+            empty = "No puzzles have been recorded yet."
+    except ValueError:
+        await send_with_rate_limit_handling(ctx.channel, RANGE_USAGE)
+        return
 
-    await send_with_rate_limit_handling(ctx.channel, msg)
+    # Per-user running totals make this O(users) however long the range is
+    indexes = await store.guild_indexes(guild_id)
+    span = indexes.range_span(first, last)
+    if span is None:
+        await send_with_rate_limit_handling(ctx.channel, empty)
+        return
+
+    msg = render_cache.get_or_render(
+        guild_id, store.version(guild_id), ("range", first, last),
+        lambda: render_range(title, *span, indexes.range_standings(first, last, WEEKLY_MISSED_PENALTY))
+    )
+    # Long histories can outgrow one message
+    for part in pack_lines(msg.rstrip("\n").split("\n")):
+        await send_with_rate_limit_handling(ctx.channel, part)
 
 
 # --- Weekly Leaderboard Logic ---
-def generate_weekly_leaderboard_message(guild_id):
+async def generate_weekly_leaderboard_message(guild_id):
     """Generate the weekly leaderboard message for a guild. Returns None if no data available."""
-    leaderboard = load_leaderboard(guild_id)
-    
-    if not leaderboard:
-        return None
-    
-    # Calculate weekly scores (last 7 puzzles)
-    puzzle_numbers = sorted([int(k) for k in leaderboard.keys()])
-    recent_puzzles = puzzle_numbers[-7:]  # Last 7 puzzles
+    # Per-user totals for the last WEEKLY_WINDOW_PUZZLES puzzles are kept up to date by the store
+    window = await store.weekly_window(guild_id)
+    recent_puzzles = window.puzzles
     
     if len(recent_puzzles) == 0:
         return None
     
-    # Aggregate scores across the week
-    weekly_scores = {}
-    
-    for puzzle_num in recent_puzzles:
-        puzzle_key = str(puzzle_num)
-        if puzzle_key in leaderboard:
-            for user_id, user_data in leaderboard[puzzle_key].items():
-                if user_id not in weekly_scores:
-                    weekly_scores[user_id] = {
-                        'name': user_data['name'],
-                        'total_guesses': 0,
-                        'puzzles_played': 0,
-                        'complete_puzzles': 0,
-                        'incomplete_puzzles': 0
-                    }
-                weekly_scores[user_id]['total_guesses'] += user_data['guesses']
-                weekly_scores[user_id]['puzzles_played'] += 1
-                
-                # Track completion status for weekly stats
-                if user_data.get('status') == 'complete':
-                    weekly_scores[user_id]['complete_puzzles'] += 1
-                elif user_data.get('status') == 'incomplete':
-                    weekly_scores[user_id]['incomplete_puzzles'] += 1
-                else:
-                    # Old format - assume complete if no status field
-                    weekly_scores[user_id]['complete_puzzles'] += 1
-    
-    # Calculate total scores with penalties for missed puzzles
-    penalty_per_missed_puzzle = 6  # High penalty for skipping puzzles
-    total_puzzles = len(recent_puzzles)
-    
-    for user_data in weekly_scores.values():
-        missed_puzzles = total_puzzles - user_data['puzzles_played']
-        penalty_points = missed_puzzles * penalty_per_missed_puzzle
-        user_data['total_score'] = user_data['total_guesses'] + penalty_points
-    
-    sorted_weekly = sorted(weekly_scores.values(), key=lambda x: x['total_score'])
-    
-    msg = f"🏆 Weekly Leaderboard (Last {len(recent_puzzles)} puzzles: #{recent_puzzles[0]}-#{recent_puzzles[-1]}) 🏆\n"
-    
-    medals = ["🥇", "🥈", "🥉"]
-    current_rank = 1
-    prev_total = None
-    
-    for idx, entry in enumerate(sorted_weekly):
-        # Handle ties - players with same total score get same rank
-        if prev_total is not None and entry['total_score'] != prev_total:
-            current_rank = idx + 1
-        
-        medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-        complete = entry.get('complete_puzzles', entry['puzzles_played'])  # Backward compatibility
-        incomplete = entry.get('incomplete_puzzles', 0)
-        msg += f"{medal} {entry['name']}: {entry['total_score']} total ({complete}✅/{incomplete}❌ of {total_puzzles} puzzles)\n"
-        prev_total = entry['total_score']
-
-    return msg
+    return render_cache.get_or_render(
+        guild_id, store.version(guild_id), ("weekly",),
+        lambda: render_weekly(recent_puzzles, window.standings(WEEKLY_MISSED_PENALTY))
+    )
 
-def generate_combined_sunday_leaderboard_message(guild_id, puzzle_key, scores):
+async def generate_combined_sunday_leaderboard_message(guild_id, puzzle_key, scores):
     """Generate a combined daily + weekly leaderboard message for Sundays with user tags."""
-    # Generate daily leaderboard portion
-    sorted_scores = sorted(scores.items(), key=lambda x: x[1]["guesses"])
-    daily_msg = f"🏆 Final Leaderboard for Puzzle #{puzzle_key} 🏆\n"
-    medals = ["🥇", "🥈", "🥉"]
-    current_rank = 1
-    prev_guesses = None
-    
-    for idx, (uid, entry) in enumerate(sorted_scores):
-        # Handle ties - players with same score get same rank
-        if prev_guesses is not None and entry['guesses'] != prev_guesses:
-            current_rank = idx + 1
-        
-        # Handle both old and new data formats for backward compatibility
-        if 'status' in entry:
-            if entry['status'] == 'complete':
-                medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-                status_display = f"{entry['guesses']} guesses"
-            else:
-                medal = "💀"  # Skull emoji for incomplete puzzles
-                status_display = f"❌ INCOMPLETE ({entry.get('connections_solved', 0)}/4)"
-        else:
-            # Old format - assume complete if no status field
-            medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-            status_display = f"{entry['guesses']} guesses"
-        
-        daily_msg += f"{medal} <@{uid}> {status_display}\n"
-        prev_guesses = entry['guesses']
-    
-    # Generate weekly leaderboard portion
-    weekly_msg_base = generate_weekly_leaderboard_message(guild_id)
-    if weekly_msg_base:
-        # Convert weekly leaderboard to use tags instead of just names
-        weekly_lines = weekly_msg_base.split('\n')[1:]  # Skip header
-        weekly_tagged_lines = []
-        
-        # We need to find user IDs for tagging in weekly leaderboard
-        leaderboard = load_leaderboard(guild_id)
-        name_to_uid = {}
-        
-        # Build mapping from display names to user IDs
-        for puzzle_data in leaderboard.values():
-            for uid, user_data in puzzle_data.items():
-                name_to_uid[user_data['name']] = uid
-        
-        for line in weekly_lines:
-            if line.strip():
-                # Replace names with tags in weekly leaderboard
-                for name, uid in name_to_uid.items():
-                    if f" {name}:" in line:
-                        line = line.replace(f" {name}:", f" <@{uid}>:")
-                        break
-                weekly_tagged_lines.append(line)
-        
-        weekly_msg = "\n\n" + weekly_msg_base.split('\n')[0] + "\n" + "\n".join(weekly_tagged_lines)
-    else:
-        weekly_msg = "\n\nNo puzzles available for weekly leaderboard."
-    
-    return daily_msg + weekly_msg
+    # The weekly totals are keyed by user ID, so both boards can tag players directly
+    window = await store.weekly_window(guild_id)
+    return render_cache.get_or_render(
+        guild_id, store.version(guild_id), ("combined", puzzle_key),
+        lambda: render_combined(puzzle_key, scores, window.puzzles, window.standings(WEEKLY_MISSED_PENALTY))
+    )
 
 # --- Command: Weekly Leaderboard ---
-@bot.command(name="weekly_leaderboard")
+@commands.command(name="weekly_leaderboard")
 async def weekly_leaderboard_cmd(ctx):
     guild_id = ctx.guild.id
-    msg = generate_weekly_leaderboard_message(guild_id)
+    msg = await generate_weekly_leaderboard_message(guild_id)
     
     if msg is None:
         await send_with_rate_limit_handling(ctx.channel, "No puzzles have been recorded yet.")
@@ -427,111 +281,449 @@ async def weekly_leaderboard_cmd(ctx):
     await send_with_rate_limit_handling(ctx.channel, msg)
 
 
-# --- Event: Final Leaderboard of the Day ---
-last_posted_minute = None
+# --- Command: Player Stats ---
+# Default and maximum number of results !history lists
+HISTORY_DEFAULT_COUNT = 10
+HISTORY_MAX_COUNT = 25
 
-@bot.event
-async def on_ready():
-    post_daily_leaderboard.start()
+@commands.command(name="stats")
+async def stats_cmd(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    history = await store.user_history(ctx.guild.id, str(member.id))
+    if history is None:
+        await send_with_rate_limit_handling(ctx.channel, f"No results recorded for {member.display_name} yet.")
+        return
+    await send_with_rate_limit_handling(ctx.channel, render_stats(history.stats()))
+
+@commands.command(name="history")
+async def history_cmd(ctx, member: typing.Optional[discord.Member] = None, count: int = HISTORY_DEFAULT_COUNT):
+    # Optional lets "!history 5" skip the member and read 5 as the count
+    member = member or ctx.author
+    history = await store.user_history(ctx.guild.id, str(member.id))
+    if history is None:
+        await send_with_rate_limit_handling(ctx.channel, f"No results recorded for {member.display_name} yet.")
+        return
+    count = min(max(count, 1), HISTORY_MAX_COUNT)
+    results = history.recent(count)
+    if not results:
+        await send_with_rate_limit_handling(
+            ctx.channel, f"All of {member.display_name}'s results have been archived; `!stats` still counts them."
+        )
+        return
+    await send_with_rate_limit_handling(ctx.channel, render_history(history.name, results))
 
-@tasks.loop(minutes=1)
-async def post_daily_leaderboard():
-    global last_posted_minute
+
+# --- Event: Final Leaderboard of the Day ---
+async def build_daily_post(guild, today_date, is_sunday):
+    """Render a guild's end-of-day message. Returns (channel, message), or None if there is nowhere to post."""
+    channel = discord.utils.get(guild.text_channels, name="connections")
+    if not channel:
+        return None
+    
+    leaderboard = await store.get_leaderboard(guild.id)
+    if not leaderboard:
+        return channel, "No puzzles have been recorded yet."
+    
+    # Check if there are results from today
+    puzzle_key = await store.latest_puzzle_on(guild.id, today_date)
+    if not puzzle_key:
+        # No results from today, post a message indicating this
+        return channel, "📅 No one has played today's Connections puzzle yet! Be the first to submit your results."
+    
+    # We have results from today, post the leaderboard
+    scores = leaderboard[puzzle_key]
+    if not scores:
+        return None
+    if is_sunday:
+        # On Sundays, post combined daily + weekly leaderboard
+        return channel, await generate_combined_sunday_leaderboard_message(guild.id, puzzle_key, scores)
+    
+    # Regular daily leaderboard for other days
+    return channel, render_cache.get_or_render(
+        guild.id, store.version(guild.id), ("final", puzzle_key),
+        lambda: render_daily(puzzle_key, scores, title="Final Leaderboard", mention=True)
+    )
+
+async def claim_daily_post(guild, local_date):
+    """Record and claim a guild's post for local_date. False if it must not be sent."""
+    # Record the post before sending it, so a restart can never post the same day twice
+    await store.update_settings(guild.id, {"last_posted": local_date.isoformat()})
+    # Another shard process (e.g. during a rolling restart) may already have sent it
+    return await store.claim_daily_post(guild.id, local_date)
+
+async def post_daily_leaderboard(due):
+    """Render and send the end-of-day post for each due (guild, local date) pair."""
     try:
-        now = datetime.datetime.now(datetime.timezone.utc)  # Change timezone if your users are not in UTC
-        today_date = now.date()
-        minute_key = f"{now.year}-{now.month}-{now.day}-{now.hour}-{now.minute}"
-        if now.hour == 21 and now.minute == 0:  # 9:00 PM UTC
-            if last_posted_minute == minute_key:
-                return  # Prevent duplicate posts in the same minute
-            last_posted_minute = minute_key
-            
-            is_sunday = now.weekday() == 6  # Sunday is 6 in Python's weekday()
+        # Claim every guild's post at once, render the messages, then send them all concurrently
+        claimed = await asyncio.gather(*(claim_daily_post(guild, local_date) for guild, local_date in due))
+        deliveries = []
+        for (guild, local_date), claim in zip(due, claimed):
+            if not claim:
+                continue
             
-            for guild in bot.guilds:
-                channel = discord.utils.get(guild.text_channels, name="connections")
-                if channel:
-                    leaderboard = load_leaderboard(guild.id)
-                    if leaderboard:
-                        # Check if there are results from today
-                        puzzle_key = get_latest_puzzle_from_today(leaderboard, today_date)
-                        
-                        if puzzle_key:
-                            # We have results from today, post the leaderboard
-                            scores = leaderboard[puzzle_key]
-                            if scores:
-                                if is_sunday:
-                                    # On Sundays, post combined daily + weekly leaderboard
-                                    combined_msg = generate_combined_sunday_leaderboard_message(guild.id, puzzle_key, scores)
-                                    await send_with_rate_limit_handling(channel, combined_msg)
-                                else:
-                                    # Regular daily leaderboard for other days
-                                    sorted_scores = sorted(scores.items(), key=lambda x: x[1]["guesses"])
-                                    msg = f"🏆 Final Leaderboard for Puzzle #{puzzle_key} 🏆\n"
-                                    medals = ["🥇", "🥈", "🥉"]
-                                    current_rank = 1
-                                    prev_guesses = None
-                                    
-                                    for idx, (uid, entry) in enumerate(sorted_scores):
-                                        # Handle ties - players with same score get same rank
-                                        if prev_guesses is not None and entry['guesses'] != prev_guesses:
-                                            current_rank = idx + 1
-                                        
-                                        # Handle both old and new data formats for backward compatibility
-                                        if 'status' in entry:
-                                            if entry['status'] == 'complete':
-                                                medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-                                                status_display = f"{entry['guesses']} guesses"
-                                            else:
-                                                medal = "💀"  # Skull emoji for incomplete puzzles
-                                                status_display = f"❌ INCOMPLETE ({entry.get('connections_solved', 0)}/4)"
-                                        else:
-                                            # Old format - assume complete if no status field
-                                            medal = medals[current_rank - 1] if current_rank <= 3 else "•"
-                                            status_display = f"{entry['guesses']} guesses"
-                                        
-                                        msg += f"{medal} <@{uid}> {status_display}\n"
-                                        prev_guesses = entry['guesses']
-                                    await send_with_rate_limit_handling(channel, msg)
-                        else:
-                            # No results from today, post a message indicating this
-                            await send_with_rate_limit_handling(channel, "📅 No one has played today's Connections puzzle yet! Be the first to submit your results.")
-                    else:
-                        await send_with_rate_limit_handling(channel, "No puzzles have been recorded yet.")
-                
-                # Add delay between guilds to prevent rate limiting
-                await asyncio.sleep(1)
+            is_sunday = local_date.weekday() == 6  # Sunday is 6 in Python's weekday()
+            delivery = await build_daily_post(guild, local_date, is_sunday)
+            if delivery:
+                deliveries.append(delivery)
+        
+        sent, failed, elapsed = await fan_out(deliveries, send_with_rate_limit_handling)
+        DAILY_POST_SECONDS.observe(elapsed)
+        DAILY_POST_GUILDS.inc(sent, result="sent")
+        DAILY_POST_GUILDS.inc(failed, result="failed")
+        print(f"Daily leaderboard posted to {sent}/{len(deliveries)} guilds in {elapsed:.1f}s ({failed} failed)")
+
+        # Once a day is also when old puzzles roll into the archive
+        for guild, _ in due:
+            keep = guild_retention(await store.get_settings(guild.id))
+            if keep:
+                archived = await store.apply_retention(guild.id, keep)
+                if archived:
+                    print(f"Archived {archived} puzzles for guild {guild.id}")
     except Exception as e:
         print(f"Error in post_daily_leaderboard: {e}")
         import traceback
         traceback.print_exc()
 
+scheduler_task = None
+loop_monitor_task = None
+warm_task = None
+web_runner = None
+
+async def on_ready():
+    global scheduler_task, loop_monitor_task, warm_task
+    record_startup_phase("ready")
+    # on_ready fires again after reconnects; keep a single scheduler running
+    if scheduler_task is None or scheduler_task.done():
+        scheduler_task = asyncio.ensure_future(scheduler.run())
+    if loop_monitor_task is None or loop_monitor_task.done():
+        loop_monitor_task = asyncio.ensure_future(monitor_event_loop())
+    # Guild data loads after connecting rather than before; a message that arrives
+    # first just loads its own guild on demand
+    if warm_task is None:
+        warm_task = asyncio.ensure_future(warm_caches())
+
+async def warm_caches():
+    """Load every guild's leaderboard and indexes into the store in the background."""
+    loaded = await store.warm([guild.id for guild in bot.guilds])
+    record_startup_phase("warm")
+    print(f"Loaded {loaded} guilds into memory")
+
+# --- Startup Timing ---
+started_at = None
+# phase -> seconds from create_bot(): built, ready (gateway connected), warm (guilds loaded)
+startup_times = {}
+
+def record_startup_phase(phase):
+    """Record the first time a startup phase is reached."""
+    if phase in startup_times:
+        return
+    elapsed = time.perf_counter() - started_at
+    startup_times[phase] = round(elapsed, 3)
+    STARTUP_SECONDS.set(elapsed, phase=phase)
+    print(f"Startup: {phase} after {elapsed:.2f}s")
+
+# --- Health ---
+def finite_or_none(value):
+    return value if value is not None and math.isfinite(value) else None
+
+def health_status():
+    """(healthy, details) for the /health endpoint: healthy while the gateway is connected."""
+    connected = bot.is_ready() and not bot.is_closed()
+    latency = finite_or_none(bot.latency)
+    details = {
+        "gateway_connected": connected,
+        "heartbeat_latency_seconds": latency,
+        "guilds": len(bot.guilds),
+        "event_loop_lag_seconds": EVENT_LOOP_LAG.value(),
+        "ack_queue_depth": ack_queue.depth(),
+        "startup_seconds": startup_times,
+    }
+    if isinstance(bot, commands.AutoShardedBot):
+        details["shards"] = {str(shard_id): finite_or_none(shard_latency) for shard_id, shard_latency in bot.latencies}
+    return connected and latency is not None, details
+
+GATEWAY_CONNECTED = Gauge("connections_gateway_connected", "1 while the Discord gateway connection is ready.")
+HEARTBEAT_LATENCY = Gauge("connections_heartbeat_latency_seconds", "Discord gateway heartbeat latency.")
+
+async def on_guild_join(guild):
+    scheduler.reschedule()
+
+# --- Command: Daily Post Schedule ---
+@commands.command(name="post_time")
+async def post_time_cmd(ctx):
+    settings = await store.get_settings(ctx.guild.id)
+    post_time = guild_post_time(settings).strftime("%H:%M")
+    await send_with_rate_limit_handling(ctx.channel, f"📅 The daily leaderboard is posted at {post_time} ({guild_timezone(settings).key}).")
+
+@commands.command(name="set_post_time")
+@commands.has_permissions(administrator=True)
+async def set_post_time_cmd(ctx, post_time: str, timezone: str = None):
+    try:
+        parsed = parse_post_time(post_time)
+        if timezone:
+            ZoneInfo(timezone)
+    except (ValueError, ZoneInfoNotFoundError):
+        await send_with_rate_limit_handling(ctx.channel, "Usage: `!set_post_time HH:MM [timezone]`, e.g. `!set_post_time 21:00 Europe/London`.")
+        return
+    
+    changes = {"post_time": parsed.strftime("%H:%M")}
+    if timezone:
+        changes["timezone"] = timezone
+    settings = await scheduler.change_schedule(ctx.guild.id, changes)
+    await send_with_rate_limit_handling(ctx.channel, f"📅 The daily leaderboard will be posted at {changes['post_time']} ({guild_timezone(settings).key}).")
+
 
 # --- Command: Clear Leaderboard (Admin) ---
-@bot.command(name="clear_leaderboard")
+@commands.command(name="clear_leaderboard")
 @commands.has_permissions(administrator=True)
 async def clear_leaderboard(ctx):
     guild_id = ctx.guild.id
-    save_leaderboard(guild_id, {})
+    await store.clear_leaderboard(guild_id)
     await send_with_rate_limit_handling(ctx.channel, "Leaderboard data cleared.")
 
-@bot.command(name="show_leaderboard_file")
+# --- Command: Backfill From Channel History ---
+# guild_id -> (task, progress dict) for the backfill running in that guild
+backfills = {}
+
+async def run_backfill(guild_id, channel, reply_channel, after_id, progress):
+    try:
+        await backfill_channel(store, guild_id, channel.id, channel_history(channel, after_id), progress=progress)
+        message = (f"✅ Backfill finished: scanned {progress['scanned']} messages and recorded "
+                   f"{progress['recorded']} results ({progress['skipped']} already recorded).")
+    except asyncio.CancelledError:
+        await send_with_rate_limit_handling(
+            reply_channel, f"⏹️ Backfill stopped after {progress['scanned']} messages. Run `!backfill` to resume."
+        )
+        raise
+    except Exception as e:
+        print(f"Error backfilling guild {guild_id}: {e}")
+        message = f"❌ Backfill failed after {progress['scanned']} messages: {e}. Run `!backfill` to resume."
+    await send_with_rate_limit_handling(reply_channel, message)
+
+@commands.command(name="backfill")
+@commands.has_permissions(administrator=True)
+async def backfill_cmd(ctx, mode: str = "resume"):
+    """!backfill [resume|full|status|cancel]: import past results from the #connections channel."""
+    guild_id = ctx.guild.id
+    task, progress = backfills.get(guild_id, (None, None))
+    running = task is not None and not task.done()
+    mode = mode.lower()
+
+    if mode == "status":
+        if running:
+            await send_with_rate_limit_handling(
+                ctx.channel, f"⏳ Backfill running: {progress['scanned']} messages scanned, {progress['recorded']} results recorded."
+            )
+        else:
+            await send_with_rate_limit_handling(ctx.channel, "No backfill is running.")
+        return
+    if mode == "cancel":
+        if running:
+            task.cancel()
+        else:
+            await send_with_rate_limit_handling(ctx.channel, "No backfill is running.")
+        return
+    if mode not in ("resume", "full"):
+        await send_with_rate_limit_handling(ctx.channel, "Usage: `!backfill [resume|full|status|cancel]`")
+        return
+    if running:
+        await send_with_rate_limit_handling(ctx.channel, "A backfill is already running; see `!backfill status`.")
+        return
+
+    channel = discord.utils.get(ctx.guild.text_channels, name="connections")
+    if channel is None:
+        await send_with_rate_limit_handling(ctx.channel, "There is no #connections channel to backfill from.")
+        return
+    # "full" rescans from the start, e.g. after !clear_leaderboard
+    after_id = await get_checkpoint(store, guild_id, channel.id) if mode == "resume" else None
+    progress = {"scanned": 0, "recorded": 0, "skipped": 0}
+    task = asyncio.ensure_future(run_backfill(guild_id, channel, ctx.channel, after_id, progress))
+    backfills[guild_id] = (task, progress)
+    start = "from the last checkpoint" if after_id else "from the beginning"
+    await send_with_rate_limit_handling(ctx.channel, f"⏳ Backfilling results from {channel.mention} {start}...")
+
+@commands.command(name="show_leaderboard_file")
 async def show_leaderboard_file(ctx):
     guild_id = ctx.guild.id
-    file_name = get_leaderboard_file(guild_id)
-    await send_with_rate_limit_handling(ctx.channel, f"Leaderboard file for this server: {file_name}")
+    file_name = store.backend.describe(guild_id)
+    indexes = await store.guild_indexes(guild_id)
+    archive = await store.archive(guild_id)
+    keep = guild_retention(await store.get_settings(guild_id))
+    retention = f"the newest {max(keep, MIN_RETENTION_PUZZLES)} puzzles" if keep else "everything"
+    await send_with_rate_limit_handling(
+        ctx.channel,
+        f"Leaderboard file for this server: {file_name}\n"
+        f"{len(indexes.puzzle_numbers)} puzzles kept in full, {archive.get('puzzles', 0)} archived "
+        f"(retention: {retention})."
+    )
+
+# --- Commands: Export, Import and Retention ---
+def guild_retention(settings):
+    """Puzzles a guild keeps in full (0 keeps everything)."""
+    return settings.get("retention_puzzles", RETENTION_PUZZLES)
+
+@commands.command(name="export")
+@commands.has_permissions(administrator=True)
+async def export_cmd(ctx):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f"connections_{ctx.guild.id}.jsonl.gz")
+        count = await export_guild(store, ctx.guild.id, path)
+        try:
+            await ctx.channel.send(f"📦 Exported {count} records.", file=discord.File(path))
+        except discord.HTTPException as e:
+            await send_with_rate_limit_handling(ctx.channel, f"❌ Couldn't upload the export: {e}")
 
-def stop_bot():
-    # This function can be called in tests to stop the bot if running
-    try:
-        if bot.is_closed():
+@commands.command(name="import")
+@commands.has_permissions(administrator=True)
+async def import_cmd(ctx):
+    if not ctx.message.attachments:
+        await send_with_rate_limit_handling(ctx.channel, "Attach a file made by `!export` to import it.")
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "import.jsonl.gz")
+        await ctx.message.attachments[0].save(path)
+        try:
+            progress = await import_guild(store, ctx.guild.id, path)
+        except (ValueError, OSError, EOFError) as e:
+            await send_with_rate_limit_handling(ctx.channel, f"❌ Couldn't import that file: {e}")
             return
-        import asyncio
-        loop = asyncio.get_event_loop()
-        loop.create_task(bot.close())
-    except Exception as e:
-        print(f"Error stopping bot: {e}")
+    archive_text = " Archived totals were restored." if progress["archive_restored"] else ""
+    await send_with_rate_limit_handling(
+        ctx.channel,
+        f"✅ Imported {progress['recorded']} results ({progress['skipped']} already recorded or archived).{archive_text}"
+    )
+
+@commands.command(name="set_retention")
+@commands.has_permissions(administrator=True)
+async def set_retention_cmd(ctx, puzzles: str):
+    if puzzles.lower() == "off":
+        keep = 0
+    else:
+        try:
+            keep = int(puzzles)
+        except ValueError:
+            await send_with_rate_limit_handling(ctx.channel, "Usage: `!set_retention <puzzles|off>`")
+            return
+        # 0 keeps everything, as RETENTION_PUZZLES=0 does
+        if keep < 0:
+            await send_with_rate_limit_handling(ctx.channel, "Usage: `!set_retention <puzzles|off>`")
+            return
+        keep = max(keep, MIN_RETENTION_PUZZLES) if keep else 0
+    await store.update_settings(ctx.guild.id, {"retention_puzzles": keep})
+    if not keep:
+        await send_with_rate_limit_handling(ctx.channel, "Retention is off; every puzzle is kept in full.")
+        return
+    archived = await store.apply_retention(ctx.guild.id, keep)
+    await send_with_rate_limit_handling(
+        ctx.channel,
+        f"Keeping the newest {keep} puzzles in full; older ones are rolled into per-player totals. "
+        f"{archived} puzzles archived now."
+    )
+
+COMMANDS = (
+    leaderboard_cmd,
+    weekly_leaderboard_cmd,
+    stats_cmd,
+    history_cmd,
+    post_time_cmd,
+    set_post_time_cmd,
+    clear_leaderboard,
+    backfill_cmd,
+    show_leaderboard_file,
+    export_cmd,
+    import_cmd,
+    set_retention_cmd,
+)
+
+
+# --- App Factory ---
+class ShutdownOnClose:
+    """Bot mixin running shutdown() before discord.py closes the HTTP session, so queued acks still go out."""
+
+    async def close(self):
+        if not self.is_closed():
+            await shutdown()
+        await super().close()
+
+class ConnectionsBot(ShutdownOnClose, commands.Bot):
+    pass
+
+class ShardedConnectionsBot(ShutdownOnClose, commands.AutoShardedBot):
+    pass
+
+def create_bot(backend=None):
+    """Build the bot with its storage, caches, acknowledgement queue, scheduler and health checks.
+
+    Nothing connects or loads here; run_bot() does that. `backend` defaults to the one
+    STORAGE_BACKEND selects.
+    """
+    global bot, store, render_cache, ack_queue, scheduler, started_at
+    started_at = time.perf_counter()
+    startup_times.clear()
+
+    intents = discord.Intents.default()
+    intents.messages = True
+    intents.guilds = True
+    intents.message_content = True  # Needed to read messages
+    # SHARD_COUNT / SHARD_IDS select a subset of shards for this process (see sharding.py)
+    shard_count, shard_ids = shard_config_from_env()
+    if shard_count:
+        bot = ShardedConnectionsBot(command_prefix="!", intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+    else:
+        bot = ConnectionsBot(command_prefix="!", intents=intents)
+    for event in (on_ready, on_message, on_guild_join):
+        bot.event(event)
+    for command in COMMANDS:
+        bot.add_command(command)
+
+    store = LeaderboardStore(backend)
+    render_cache = RenderCache()
+    ack_queue = OutboundQueue()
+    scheduler = DailyScheduler(lambda: bot.guilds, store, post_daily_leaderboard)
+
+    ACK_QUEUE_DEPTH.set_function(ack_queue.depth)
+    GATEWAY_CONNECTED.set_function(lambda: 1 if bot.is_ready() and not bot.is_closed() else 0)
+    HEARTBEAT_LATENCY.set_function(lambda: bot.latency)
+    set_health_check(health_status)
+    record_startup_phase("built")
+    return bot
+
+async def shutdown():
+    """Send queued acknowledgements and stop background work. Runs from bot.close(), while the bot can still send."""
+    global web_runner
+    await ack_queue.drain()
+    for task in (scheduler_task, loop_monitor_task, warm_task, *(task for task, _ in backfills.values())):
+        if task is not None:
+            task.cancel()
+    if web_runner is not None:
+        runner, web_runner = web_runner, None
+        await runner.cleanup()
+
+async def run_bot(token):
+    """Connect the bot built by create_bot() and run it until it closes (bot.close() calls shutdown())."""
+    global web_runner
+    async with bot:
+        # Health/metrics server, on this loop so it adds no thread and dies with the bot;
+        # /health answers 503 until the gateway is ready
+        try:
+            web_runner = await start_web_server()
+        except OSError as e:
+            print(f"Could not start web server: {e}")
+        await bot.start(token)
+
+def main():
+    load_dotenv()
+    discord.utils.setup_logging()
+    create_bot()
+    try:
+        asyncio.run(run_bot(os.getenv("DISCORD_TOKEN")))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Fold outstanding journal records into snapshots and release the backend
+        store.close()
+
 
 # --- Run the Bot ---
 if __name__ == "__main__":
-    bot.run(os.getenv("DISCORD_TOKEN"))
+    main()
@@ -0,0 +1,207 @@
+"""Export and import a guild's leaderboard data as gzip-compressed JSON lines.
+
+    python export.py export <guild_id> <file.jsonl.gz>
+    python export.py import <guild_id> <file.jsonl.gz>
+
+The first line is a header. Every other line is one record: the archive's totals,
+one archived player summary, or one submission (shaped like a journal record).
+Archive records come first. Files are written and read a line at a time, so an
+export never builds the file in memory and an import never holds more than one
+batch.
+"""
+import os
+import sys
+import copy
+import gzip
+import json
+import asyncio
+import datetime
+import itertools
+
+from metrics import STORAGE_SECONDS
+from indexes import new_summary
+from storage import check_record
+
+EXPORT_FORMAT = "connections-leaderboard"
+EXPORT_VERSION = 1
+# Submissions written per store.merge_submissions() call while importing
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+ARCHIVE_FIELDS = ("before", "first", "last", "puzzles")
+SUMMARY_FIELDS = tuple(new_summary(""))
+
+
+# --- File Format ---
+def guild_records(leaderboard, archive):
+    """Yield export records for a guild: archive first, then submissions oldest puzzle first.
+
+    Streak state is left out; importing rebuilds it from the submissions.
+    """
+    if archive.get("puzzles"):
+        yield dict({"op": "archive_meta"}, **{key: archive[key] for key in ARCHIVE_FIELDS})
+        for user_id, summary in archive["users"].items():
+            yield {"op": "archive_user", "user_id": user_id, "summary": summary}
+    for puzzle_key in sorted(leaderboard, key=int):
+        for user_id, entry in leaderboard[puzzle_key].items():
+            yield {"op": "submit", "puzzle": puzzle_key, "user_id": user_id, "entry": entry}
+
+def write_export(path, guild_id, records):
+    """Stream records to a gzip JSON-lines file. Returns the number of records written."""
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        header = {
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_VERSION,
+            "guild_id": guild_id,
+            "exported_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        f.write(json.dumps(header) + "\n")
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+            count += 1
+    return count
+
+def summary_is_valid(summary):
+    """True if an archived player summary has every field, with the types stats expect."""
+    if any(key not in summary for key in SUMMARY_FIELDS) or not isinstance(summary["name"], str):
+        return False
+    histogram = summary["guess_histogram"]
+    counts = [summary[key] for key in SUMMARY_FIELDS if key not in ("name", "guess_histogram")]
+    if not isinstance(histogram, dict) or any(not isinstance(key, str) for key in histogram):
+        return False
+    return all(type(value) is int and value >= 0 for value in counts + list(histogram.values()))
+
+def check_export_record(record):
+    """Raise ValueError unless a record from an export file can be imported."""
+    if not isinstance(record, dict):
+        raise ValueError("record is not an object")
+    op = record.get("op")
+    if op == "submit":
+        check_record(record)
+    elif op == "archive_meta":
+        if any(type(record.get(key)) is not int for key in ARCHIVE_FIELDS):
+            raise ValueError("archive totals are incomplete")
+    elif op == "archive_user":
+        summary = record.get("summary")
+        if not isinstance(record.get("user_id"), str) or not isinstance(summary, dict):
+            raise ValueError("archived player record is malformed")
+        if not summary_is_valid(summary):
+            raise ValueError(f"archived summary for {record['user_id']} is incomplete or malformed")
+    else:
+        raise ValueError(f"unknown record type {op!r}")
+
+def read_export(path):
+    """Yield the records in an export file. Raises ValueError if it isn't one or a record is bad."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            header = json.loads(f.readline())
+        except (ValueError, OSError):
+            raise ValueError("not a leaderboard export")
+        if not isinstance(header, dict) or header.get("format") != EXPORT_FORMAT:
+            raise ValueError("not a leaderboard export")
+        if type(header.get("version", 0)) is not int:
+            raise ValueError("not a leaderboard export")
+        if header.get("version", 0) > EXPORT_VERSION:
+            raise ValueError(f"export version {header['version']} is newer than this bot supports")
+        for line_number, line in enumerate(f, start=2):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                    check_export_record(record)
+                except ValueError as e:
+                    raise ValueError(f"line {line_number}: {e}")
+                yield record
+
+def check_export(path):
+    """Read a whole export file, raising ValueError at the first bad record."""
+    for _ in read_export(path):
+        pass
+
+
+# --- Export / Import ---
+async def export_guild(store, guild_id, path):
+    """Write a guild's data to `path`. Returns the number of records written.
+
+    The guild is copied under its lock, so the export is a consistent snapshot, and the
+    file is written after the lock is released so live submissions don't wait for it.
+    Entries are replaced rather than changed in place, so copying the puzzle dicts is enough.
+    """
+    async with store.lock(guild_id):
+        leaderboard = await store.get_leaderboard(guild_id)
+        leaderboard = {puzzle_key: dict(scores) for puzzle_key, scores in leaderboard.items()}
+        # Retention updates archived summaries in place
+        archive = copy.deepcopy(await store.archive(guild_id))
+    with STORAGE_SECONDS.time(operation="export"):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, write_export, path, guild_id, guild_records(leaderboard, archive)
+        )
+
+async def import_guild(store, guild_id, path, batch_size=IMPORT_BATCH_SIZE):
+    """Merge an export file into a guild; results the guild already has win.
+
+    The archive is only restored into a guild with no archive and no older results.
+    Returns {"recorded", "skipped", "archive_restored"}. Raises ValueError for a bad file,
+    before anything is written.
+    """
+    loop = asyncio.get_running_loop()
+    # Check every record first, so a bad line can't leave a half-imported guild
+    await loop.run_in_executor(None, check_export, path)
+    records = read_export(path)
+    progress = {"recorded": 0, "skipped": 0, "archive_restored": False}
+    archive = {}
+    archive_done = False
+    try:
+        while True:
+            # Decompress and decode off the event loop
+            chunk = await loop.run_in_executor(None, lambda: list(itertools.islice(records, batch_size)))
+            if not chunk:
+                break
+            submissions = []
+            for record in chunk:
+                op = record.get("op")
+                if op == "archive_meta":
+                    archive.update({key: record[key] for key in ARCHIVE_FIELDS})
+                elif op == "archive_user":
+                    archive.setdefault("users", {})[record["user_id"]] = record["summary"]
+                elif op == "submit":
+                    if not archive_done:
+                        # The archive is complete once submissions start
+                        archive_done = True
+                        if archive:
+                            progress["archive_restored"] = await store.restore_archive(guild_id, archive)
+                    submissions.append((record["puzzle"], record["user_id"], record["entry"]))
+            if submissions:
+                recorded, skipped = await store.merge_submissions(guild_id, submissions)
+                progress["recorded"] += recorded
+                progress["skipped"] += skipped
+        if archive and not archive_done:
+            progress["archive_restored"] = await store.restore_archive(guild_id, archive)
+    finally:
+        records.close()
+    return progress
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ("export", "import"):
+        print(__doc__)
+        return 2
+    from storage import LeaderboardStore
+    command, guild_id, path = sys.argv[1], int(sys.argv[2]), sys.argv[3]
+
+    async def run():
+        store = LeaderboardStore()
+        try:
+            if command == "export":
+                print(f"Exported {await export_guild(store, guild_id, path)} records to {path}")
+            else:
+                progress = await import_guild(store, guild_id, path)
+                print(f"Imported {progress['recorded']} results ({progress['skipped']} skipped), "
+                      f"archive {'restored' if progress['archive_restored'] else 'not restored'}")
+        finally:
+            store.close()
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
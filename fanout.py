@@ -0,0 +1,37 @@
+import os
+import time
+import asyncio
+
+# How many guild channels the daily post sends to at once
+DAILY_POST_CONCURRENCY = int(os.getenv("DAILY_POST_CONCURRENCY", "10"))
+
+
+async def fan_out(deliveries, send, concurrency=DAILY_POST_CONCURRENCY):
+    """Send pre-rendered (channel, message) pairs concurrently, at most `concurrency` in flight.
+
+    `send(channel, message)` should return True on success (send_with_rate_limit_handling
+    does). Each guild posts to its own channel, which is its own rate-limit bucket in
+    discord.py's HTTP client, so there is no fixed pause between guilds: the client
+    waits out exhausted buckets and send() honours any Retry-After that still reaches it.
+
+    Returns (sent, failed, elapsed_seconds).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(channel, message):
+        async with semaphore:
+            return await send(channel, message)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(deliver(channel, message) for channel, message in deliveries), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+
+    sent = 0
+    for (channel, _), result in zip(deliveries, results):
+        if result is True:
+            sent += 1
+        elif isinstance(result, Exception):
+            print(f"Error posting to channel {getattr(channel, 'id', channel)}: {result}")
+    return sent, len(deliveries) - sent, elapsed
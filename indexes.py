@@ -0,0 +1,417 @@
+import os
+import bisect
+import datetime
+from array import array
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Weekly leaderboard: how many of the most recent puzzles count, and the points added
+# for each of those puzzles a player skipped
+WEEKLY_WINDOW_PUZZLES = int(os.getenv("WEEKLY_WINDOW_PUZZLES", "7"))
+WEEKLY_MISSED_PENALTY = int(os.getenv("WEEKLY_MISSED_PENALTY", "6"))
+# Timezone for guilds that haven't picked one; "today" and the daily post follow it
+DEFAULT_TIMEZONE = os.getenv("DAILY_POST_TIMEZONE", "UTC")
+# NYT Connections puzzle #1 was published on this date, with one puzzle a day since
+FIRST_PUZZLE_DATE = datetime.date(2023, 6, 12)
+
+
+def guild_timezone(settings):
+    """The ZoneInfo for a guild's settings, falling back to DEFAULT_TIMEZONE."""
+    try:
+        return ZoneInfo(settings.get("timezone") or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"Unknown timezone {settings.get('timezone')!r}, using {DEFAULT_TIMEZONE}")
+        return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def puzzle_for_date(date):
+    """The puzzle number published on a date."""
+    return (date - FIRST_PUZZLE_DATE).days + 1
+
+def latest_puzzle_number(today=None):
+    """The highest puzzle number published so far: tomorrow's UTC puzzle, as some timezones are a day ahead."""
+    if today is None:
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+    return puzzle_for_date(today) + 1
+
+def check_submission(puzzle_key, entry):
+    """Raise ValueError unless a result can be recorded and indexed.
+
+    The puzzle key must be a published puzzle number as a string, and the entry needs
+    a name and non-negative integer guess counts.
+    """
+    if not isinstance(puzzle_key, str) or not puzzle_key.isdigit():
+        raise ValueError(f"bad puzzle number {puzzle_key!r}")
+    if not 1 <= int(puzzle_key) <= latest_puzzle_number():
+        raise ValueError(f"puzzle #{puzzle_key} hasn't been published")
+    if not isinstance(entry, dict) or not isinstance(entry.get('name'), str):
+        raise ValueError(f"result for puzzle #{puzzle_key} has no player name")
+    for key in ('guesses', 'actual_guesses', 'connections_solved'):
+        value = entry.get(key, 0)
+        if (key == 'guesses' and key not in entry) or type(value) is not int or value < 0:
+            raise ValueError(f"result for puzzle #{puzzle_key} has a bad {key}")
+
+def month_puzzle_range(year, month):
+    """(first, last) puzzle numbers published in a calendar month."""
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return max(1, puzzle_for_date(datetime.date(year, month, 1))), puzzle_for_date(next_month) - 1
+
+
+def entry_date(entry, tz=None):
+    """The date an entry was submitted on (in tz, if given), or None if it has no usable timestamp."""
+    try:
+        submitted = datetime.datetime.fromisoformat(entry['timestamp'])
+    except (KeyError, ValueError, TypeError):
+        return None
+    if tz is not None and submitted.tzinfo is not None:
+        submitted = submitted.astimezone(tz)
+    return submitted.date()
+
+
+class WeeklyWindow:
+    """Per-user totals over the last `size` puzzles, updated as submissions arrive.
+
+    When a newer puzzle enters a full window the oldest puzzle's entries are
+    subtracted again, so reading the weekly standings never touches history.
+    """
+
+    def __init__(self, size=WEEKLY_WINDOW_PUZZLES):
+        self.size = size
+        self.puzzles = []  # puzzle numbers in the window, ascending
+        self.totals = {}   # user_id -> running totals for the window
+
+    @classmethod
+    def build(cls, leaderboard, size=WEEKLY_WINDOW_PUZZLES):
+        window = cls(size)
+        window.puzzles = sorted(int(k) for k in leaderboard.keys())[-size:] if size > 0 else []
+        for puzzle_num in window.puzzles:
+            for user_id, entry in leaderboard[str(puzzle_num)].items():
+                window._add_entry(user_id, entry)
+        return window
+
+    def add_submission(self, leaderboard, puzzle_key, user_id, entry):
+        """Fold in a submission that has just been added to the leaderboard."""
+        puzzle_num = int(puzzle_key)
+        if puzzle_num not in self.puzzles:
+            if self.size <= 0 or (len(self.puzzles) >= self.size and puzzle_num < self.puzzles[0]):
+                return  # Too old to count this week
+            bisect.insort(self.puzzles, puzzle_num)
+            if len(self.puzzles) > self.size:
+                self._evict(leaderboard, self.puzzles.pop(0))
+        self._add_entry(user_id, entry)
+
+    def _add_entry(self, user_id, entry, sign=1):
+        if user_id not in self.totals:
+            self.totals[user_id] = {
+                'name': entry['name'],
+                'total_guesses': 0,
+                'puzzles_played': 0,
+                'complete_puzzles': 0,
+                'incomplete_puzzles': 0
+            }
+        totals = self.totals[user_id]
+        totals['total_guesses'] += sign * entry['guesses']
+        totals['puzzles_played'] += sign
+        
+        # Track completion status for weekly stats
+        if entry.get('status') == 'incomplete':
+            totals['incomplete_puzzles'] += sign
+        else:
+            # 'complete', or old format with no status field
+            totals['complete_puzzles'] += sign
+        
+        if totals['puzzles_played'] == 0:
+            del self.totals[user_id]
+
+    def _evict(self, leaderboard, puzzle_num):
+        for user_id, entry in leaderboard.get(str(puzzle_num), {}).items():
+            self._add_entry(user_id, entry, sign=-1)
+
+    def standings(self, penalty=WEEKLY_MISSED_PENALTY):
+        """(user_id, totals) pairs best first, with total_score including the missed-puzzle penalty."""
+        total_puzzles = len(self.puzzles)
+        results = []
+        for user_id, totals in self.totals.items():
+            missed_puzzles = total_puzzles - totals['puzzles_played']
+            results.append((user_id, dict(totals, total_score=totals['total_guesses'] + missed_puzzles * penalty)))
+        results.sort(key=lambda item: item[1]['total_score'])
+        return results
+
+
+def entry_values(entry):
+    """(score, guesses played, groups solved) for a leaderboard entry; 4 groups solved means complete."""
+    complete = entry.get('status') != 'incomplete'  # old format has no status field
+    return (
+        min(entry['guesses'], 0xFFFF),
+        min(entry.get('actual_guesses', entry['guesses']), 0xFFFF),
+        4 if complete else min(entry.get('connections_solved', 0), 3),
+    )
+
+def streak_runs(puzzles, summary=None):
+    """(current, best) for ascending puzzle numbers: the run ending at the last one, and the longest run.
+
+    With an archive summary, runs carry on from the player's archived puzzles.
+    """
+    best = run = 0
+    previous = None
+    if summary:
+        previous, run, best = summary['last_puzzle'], summary['trailing_streak'], summary['best_streak']
+    for puzzle_num in puzzles:
+        run = run + 1 if previous is not None and puzzle_num == previous + 1 else 1
+        best = max(best, run)
+        previous = puzzle_num
+    return run, best
+
+
+# --- Archive Summaries ---
+# Puzzles older than a guild's retention window are folded into one summary per player
+# (see storage.archive_puzzles). Summaries hold the totals stats and all-time standings
+# need, plus enough streak state to carry runs on into the retained puzzles.
+def new_summary(name):
+    return {
+        'name': name,
+        'played': 0,
+        'completed': 0,
+        'total_score': 0,
+        'completed_guesses': 0,
+        'guess_histogram': {},
+        'last_puzzle': None,
+        'trailing_streak': 0,
+        'best_streak': 0,
+    }
+
+def add_to_summary(summary, puzzle_num, entry):
+    """Fold one entry into a summary. Entries must arrive in ascending puzzle order."""
+    score, guesses, solved = entry_values(entry)
+    summary['name'] = entry['name']
+    summary['played'] += 1
+    summary['total_score'] += score
+    if solved == 4:
+        summary['completed'] += 1
+        summary['completed_guesses'] += guesses
+        summary['guess_histogram'][str(guesses)] = summary['guess_histogram'].get(str(guesses), 0) + 1
+    if summary['last_puzzle'] is not None and puzzle_num == summary['last_puzzle'] + 1:
+        summary['trailing_streak'] += 1
+    else:
+        summary['trailing_streak'] = 1
+    summary['best_streak'] = max(summary['best_streak'], summary['trailing_streak'])
+    summary['last_puzzle'] = puzzle_num
+
+
+class UserHistory:
+    """One player's results as parallel arrays ordered by puzzle number.
+
+    A result costs 18 bytes here instead of a dict of strings in the leaderboard, and
+    stats only ever walk this one player's arrays. The cumulative columns hold running
+    totals (entry i covers the first i results), so totals over any puzzle range are
+    two bisects and two subtractions. `summary` is the player's archive summary, if any.
+    """
+
+    __slots__ = (
+        "name", "puzzles", "scores", "guesses", "solved", "cumulative_scores", "cumulative_completed", "summary"
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.puzzles = array("I")  # puzzle numbers, ascending
+        self.scores = array("H")   # leaderboard score (guesses, or the incomplete penalty)
+        self.guesses = array("H")  # guess rows actually played
+        self.solved = array("B")   # groups solved; 4 means complete
+        self.cumulative_scores = array("I", [0])
+        self.cumulative_completed = array("I", [0])
+        self.summary = None
+
+    def __len__(self):
+        return len(self.puzzles)
+
+    def add(self, puzzle_key, entry):
+        """Record an entry; a result for a puzzle already present replaces it."""
+        puzzle_num = int(puzzle_key)
+        values = entry_values(entry)
+        if not self.puzzles or puzzle_num > self.puzzles[-1]:
+            # The usual case: the newest puzzle
+            self.name = entry['name']
+            self.puzzles.append(puzzle_num)
+            for column, value in zip((self.scores, self.guesses, self.solved), values):
+                column.append(value)
+            self.cumulative_scores.append(self.cumulative_scores[-1] + values[0])
+            self.cumulative_completed.append(self.cumulative_completed[-1] + (values[2] == 4))
+            return
+        index = bisect.bisect_left(self.puzzles, puzzle_num)
+        if index < len(self.puzzles) and self.puzzles[index] == puzzle_num:
+            for column, value in zip((self.scores, self.guesses, self.solved), values):
+                column[index] = value
+        else:
+            self.puzzles.insert(index, puzzle_num)
+            for column, value in zip((self.scores, self.guesses, self.solved), values):
+                column.insert(index, value)
+            self.cumulative_scores.append(0)
+            self.cumulative_completed.append(0)
+        # A backfilled result shifts every running total after it
+        for i in range(index, len(self.puzzles)):
+            self.cumulative_scores[i + 1] = self.cumulative_scores[i] + self.scores[i]
+            self.cumulative_completed[i + 1] = self.cumulative_completed[i] + (self.solved[i] == 4)
+
+    def range_totals(self, first, last):
+        """(puzzles played, total score, puzzles completed) for puzzles first..last inclusive."""
+        lo = bisect.bisect_left(self.puzzles, first)
+        hi = bisect.bisect_right(self.puzzles, last)
+        if hi <= lo:
+            return 0, 0, 0
+        return (
+            hi - lo,
+            self.cumulative_scores[hi] - self.cumulative_scores[lo],
+            self.cumulative_completed[hi] - self.cumulative_completed[lo],
+        )
+
+    def streaks(self):
+        """(current, best): the run ending at the latest puzzle played, and the longest run."""
+        return streak_runs(self.puzzles, self.summary)
+
+    def stats(self):
+        """Lifetime stats, archived puzzles included."""
+        summary = self.summary or new_summary(self.name)
+        completed_guesses = [g for g, solved in zip(self.guesses, self.solved) if solved == 4]
+        played = len(self.puzzles) + summary['played']
+        completed = len(completed_guesses) + summary['completed']
+        histogram = {int(guesses): count for guesses, count in summary['guess_histogram'].items()}
+        for guesses in completed_guesses:
+            histogram[guesses] = histogram.get(guesses, 0) + 1
+        current, best = self.streaks()
+        return {
+            'name': self.name,
+            'played': played,
+            'completed': completed,
+            'failed': played - completed,
+            'completion_rate': completed / played if played else 0.0,
+            'average_guesses': (sum(completed_guesses) + summary['completed_guesses']) / completed if completed else None,
+            'average_score': (sum(self.scores) + summary['total_score']) / played if played else None,
+            'current_streak': current,
+            'best_streak': best,
+            'guess_histogram': dict(sorted(histogram.items())),
+        }
+
+    def recent(self, limit):
+        """Up to `limit` (puzzle, score, guesses, solved) tuples, most recent first."""
+        start = max(0, len(self.puzzles) - limit)
+        return list(zip(self.puzzles[start:], self.scores[start:], self.guesses[start:], self.solved[start:]))[::-1]
+
+
+class GuildIndexes:
+    """Lookup tables derived from one guild's leaderboard, kept in step with every write.
+
+    Built once when the guild is loaded, then updated per journal record so queries
+    never have to walk the full history.
+    """
+
+    def __init__(self, tz=None):
+        # Guild-local date -> set of puzzle numbers with at least one submission that day
+        self.tz = tz
+        self.puzzles_by_date = {}
+        self.weekly = WeeklyWindow()
+        # user_id -> UserHistory
+        self.histories = {}
+        # Every puzzle number with at least one result, ascending
+        self.puzzle_numbers = array("I")
+        # The guild's archive (see storage.archive_puzzles); {} until retention kicks in
+        self.archive = {}
+
+    @classmethod
+    def build(cls, leaderboard, tz=None, archive=None):
+        indexes = cls(tz)
+        indexes.archive = archive if archive is not None else {}
+        for user_id, summary in indexes.archive.get("users", {}).items():
+            history = indexes.histories[user_id] = UserHistory(summary['name'])
+            history.summary = summary
+        # Oldest first, so histories only ever append
+        for puzzle_key in sorted(leaderboard, key=int):
+            for user_id, entry in leaderboard[puzzle_key].items():
+                indexes._index_date(puzzle_key, entry)
+                indexes._add_history(puzzle_key, user_id, entry)
+        indexes.weekly = WeeklyWindow.build(leaderboard)
+        return indexes
+
+    def apply(self, leaderboard, record, archive=None):
+        """Update the indexes for a journal record that was just applied to the leaderboard (and archive)."""
+        op = record.get("op")
+        if op == "submit":
+            self._index_date(record["puzzle"], record["entry"])
+            self._add_history(record["puzzle"], record["user_id"], record["entry"])
+            self.weekly.add_submission(leaderboard, record["puzzle"], record["user_id"], record["entry"])
+        elif op == "clear":
+            self.__init__(self.tz)
+        elif op in ("archive", "restore_archive"):
+            # Rare and touches most of the history, so just start over
+            self.__dict__.update(GuildIndexes.build(leaderboard, self.tz, archive).__dict__)
+
+    def _index_date(self, puzzle_key, entry):
+        date = entry_date(entry, self.tz)
+        if date is not None:
+            self.puzzles_by_date.setdefault(date, set()).add(int(puzzle_key))
+
+    def _add_history(self, puzzle_key, user_id, entry):
+        puzzle_num = int(puzzle_key)
+        if not self.puzzle_numbers or puzzle_num > self.puzzle_numbers[-1]:
+            self.puzzle_numbers.append(puzzle_num)
+        else:
+            index = bisect.bisect_left(self.puzzle_numbers, puzzle_num)
+            if index == len(self.puzzle_numbers) or self.puzzle_numbers[index] != puzzle_num:
+                self.puzzle_numbers.insert(index, puzzle_num)
+        if user_id not in self.histories:
+            self.histories[user_id] = UserHistory(entry['name'])
+        self.histories[user_id].add(puzzle_key, entry)
+
+    def latest_puzzle_on(self, date):
+        puzzles = self.puzzles_by_date.get(date)
+        return str(max(puzzles)) if puzzles else None
+
+    def archived_before(self):
+        """Puzzles below this number have been archived and can no longer be recorded."""
+        return self.archive.get("before", 0)
+
+    def _covers_archive(self, first, last):
+        # Archived puzzles only survive as per-player totals, so they count towards a
+        # range in full or not at all
+        return bool(self.archive.get("puzzles")) and first <= self.archive["first"] and last >= self.archive["before"] - 1
+
+    def range_span(self, first, last):
+        """(puzzle count, lowest, highest) over puzzles with results in first..last, or None if there are none."""
+        lo = bisect.bisect_left(self.puzzle_numbers, first)
+        hi = bisect.bisect_right(self.puzzle_numbers, last)
+        count, lowest, highest = hi - lo, None, None
+        if hi > lo:
+            lowest, highest = self.puzzle_numbers[lo], self.puzzle_numbers[hi - 1]
+        if self._covers_archive(first, last):
+            count += self.archive["puzzles"]
+            lowest = self.archive["first"]
+            highest = highest if highest is not None else self.archive["last"]
+        return (count, lowest, highest) if count else None
+
+    def range_standings(self, first, last, penalty=WEEKLY_MISSED_PENALTY):
+        """Standings over puzzles first..last, in the same form as WeeklyWindow.standings().
+
+        As on the weekly board, only puzzles somebody played count, and each of those a
+        player skipped adds `penalty`. Costs O(users * log history) whatever the range.
+        Archived puzzles are included when the range spans all of them (e.g. all time).
+        """
+        span = self.range_span(first, last)
+        total_puzzles = span[0] if span else 0
+        include_archive = self._covers_archive(first, last)
+        results = []
+        for user_id, history in self.histories.items():
+            played, total_guesses, completed = history.range_totals(first, last)
+            if include_archive and history.summary:
+                played += history.summary['played']
+                total_guesses += history.summary['total_score']
+                completed += history.summary['completed']
+            if not played:
+                continue
+            results.append((user_id, {
+                'name': history.name,
+                'total_guesses': total_guesses,
+                'puzzles_played': played,
+                'complete_puzzles': completed,
+                'incomplete_puzzles': played - completed,
+                'total_score': total_guesses + (total_puzzles - played) * penalty,
+            }))
+        results.sort(key=lambda item: item[1]['total_score'])
+        return results
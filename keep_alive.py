@@ -1,15 +1,52 @@
-from flask import Flask
-from threading import Thread
+import os
 
-app = Flask("")
+from aiohttp import web
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+from metrics import render_metrics
 
-def run():
-    app.run(host='0.0.0.0', port=8081)
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8081"))
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
\ No newline at end of file
+# Callable returning (healthy, details dict); set by the bot with set_health_check()
+health_check = None
+
+def set_health_check(check):
+    global health_check
+    health_check = check
+
+
+# --- Routes ---
+async def home(request):
+    return web.Response(text="Bot is running!")
+
+async def metrics(request):
+    return web.Response(
+        body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+async def health(request):
+    if health_check is None:
+        return web.json_response({"status": "starting"}, status=503)
+    healthy, details = health_check()
+    return web.json_response(dict(details, status="ok" if healthy else "unhealthy"), status=200 if healthy else 503)
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/', home)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/health', health)
+    return app
+
+
+# --- Server ---
+async def start_web_server(host=WEB_HOST, port=WEB_PORT):
+    """Serve the app on the running event loop. Returns the AppRunner; await runner.cleanup() to stop."""
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except Exception:
+        await runner.cleanup()
+        raise
+    print(f"Web server listening on {host}:{port}")
+    return runner
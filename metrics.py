@@ -0,0 +1,171 @@
+import math
+import time
+import asyncio
+import threading
+
+# --- Metric Types ---
+# A small Prometheus text-format registry; enough for counters, gauges and histograms
+# with labels, without pulling in prometheus_client.
+REGISTRY = []
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() at scrape time instead."""
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        if self._function is None:
+            return super().render()
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {_format_value(self._function())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def time(self, **labels):
+        """Context manager observing the wall-clock duration of its body."""
+        return _Timer(self, labels)
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = [
+            f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', _format_value(bound))])} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Bot Metrics ---
+PARSE_SECONDS = Histogram("connections_parse_seconds", "Time to parse a message in the results channel.")
+STORAGE_SECONDS = Histogram("connections_storage_seconds", "Storage operation latency.", ["operation"])
+STORAGE_BYTES = Counter("connections_storage_bytes_total", "Bytes read from or written to JSON storage files.", ["direction"])
+CACHE_REQUESTS = Counter("connections_cache_requests_total", "Cache lookups.", ["cache", "result"])
+SEND_RETRIES = Counter("connections_send_retries_total", "Message sends retried after a 429 or server error.")
+SEND_RATE_LIMITED = Counter("connections_send_rate_limited_total", "Message sends answered with HTTP 429.")
+SEND_FAILURES = Counter("connections_send_failures_total", "Messages given up on.")
+SENDS = Counter("connections_sends_total", "Messages sent successfully.")
+ACK_QUEUE_DEPTH = Gauge("connections_ack_queue_depth", "Acknowledgements waiting in the outbound queue.")
+ACK_DROPPED = Counter("connections_ack_dropped_total", "Acknowledgements dropped (queue full or send failed).")
+EVENT_LOOP_LAG = Gauge("connections_event_loop_lag_latest_seconds", "Most recent event loop scheduling delay.")
+EVENT_LOOP_LAG_SECONDS = Histogram("connections_event_loop_lag_seconds", "Event loop scheduling delay.")
+DAILY_POST_SECONDS = Histogram("connections_daily_post_fanout_seconds", "Time to send the daily post to all due guilds.")
+DAILY_POST_GUILDS = Counter("connections_daily_post_guilds_total", "Daily posts by outcome.", ["result"])
+STARTUP_SECONDS = Gauge("connections_startup_seconds", "Seconds from create_bot() to each startup phase.", ["phase"])
+
+
+# --- Event Loop Lag ---
+async def monitor_event_loop(interval=1.0):
+    """Sleep `interval` seconds at a time and record how late each wake-up was."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
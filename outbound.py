@@ -0,0 +1,142 @@
+import os
+import random
+import asyncio
+
+import discord
+
+from metrics import SENDS, SEND_RETRIES, SEND_RATE_LIMITED, SEND_FAILURES, ACK_DROPPED
+
+# Acknowledgements arriving within this many seconds in one channel are sent as one message
+ACK_BATCH_WINDOW = float(os.getenv("ACK_BATCH_WINDOW", "1.5"))
+# Acknowledgements waiting per channel before new ones are dropped
+ACK_MAX_PENDING = int(os.getenv("ACK_MAX_PENDING", "200"))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Discord's message length limit
+MAX_MESSAGE_LENGTH = 2000
+
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retry `attempt` (0-based): Retry-After if given, else exponential backoff.
+
+    Jitter is added either way so channels that were limited together don't retry together.
+    """
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None and getattr(response, "headers", None):
+        retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return float(retry_after) + random.uniform(0, 0.5)
+        except ValueError:
+            pass
+    return random.uniform(0, min(30.0, 2 ** attempt))
+
+
+async def send_with_rate_limit_handling(channel, message, max_retries=SEND_MAX_RETRIES):
+    """Send a message to a channel, retrying 429s and server errors with jittered backoff."""
+    for attempt in range(max_retries):
+        try:
+            await channel.send(message)
+            SENDS.inc()
+            return True
+        except discord.HTTPException as e:
+            if e.status == 429:  # Rate limited
+                SEND_RATE_LIMITED.inc()
+            elif e.status < 500:
+                # Client errors (missing permissions, bad request) won't succeed on retry
+                print(f"HTTP error sending message: {e}")
+                SEND_FAILURES.inc()
+                return False
+            if attempt + 1 == max_retries:
+                break
+            delay = retry_delay(e, attempt)
+            SEND_RETRIES.inc()
+            print(f"Send failed with HTTP {e.status}, waiting {delay:.1f} seconds before retry {attempt + 1}/{max_retries - 1}")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            print(f"Unexpected error sending message: {e}")
+            SEND_FAILURES.inc()
+            return False
+
+    print(f"Failed to send message after {max_retries} attempts")
+    SEND_FAILURES.inc()
+    return False
+
+
+def pack_lines(lines, limit=MAX_MESSAGE_LENGTH):
+    """Join lines into as few messages as possible without exceeding Discord's length limit."""
+    messages = []
+    current = ""
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        messages.append(current)
+    return messages
+
+
+class OutboundQueue:
+    """Per-channel queue that coalesces short acknowledgements into batched messages.
+
+    The first acknowledgement in a quiet channel opens a `window`-second batch; anything
+    else queued for that channel before it closes goes out in the same message. Batches
+    for one channel are sent in order.
+    """
+
+    def __init__(self, send=send_with_rate_limit_handling, window=ACK_BATCH_WINDOW, max_pending=ACK_MAX_PENDING):
+        self.send = send
+        self.window = window
+        self.max_pending = max_pending
+        self.dropped = 0
+        self.batches_sent = 0
+        self._pending = {}   # channel id -> (channel, [lines])
+        self._tasks = {}     # channel id -> batch task
+        self._locks = {}     # channel id -> lock keeping batches in order
+
+    def depth(self):
+        """Acknowledgements waiting to be sent, across all channels."""
+        return sum(len(lines) for _, lines in self._pending.values())
+
+    def enqueue(self, channel, text):
+        """Queue an acknowledgement. Returns False if the channel's queue is full and it was dropped."""
+        _, lines = self._pending.setdefault(channel.id, (channel, []))
+        if len(lines) >= self.max_pending:
+            self.dropped += 1
+            ACK_DROPPED.inc()
+            return False
+        lines.append(text)
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.ensure_future(self._send_batch(channel.id, self.window))
+        return True
+
+    async def _send_batch(self, channel_id, delay):
+        await asyncio.sleep(delay)
+        # Anything queued from here on opens the next batch
+        self._tasks.pop(channel_id, None)
+        channel, lines = self._pending.pop(channel_id, (None, []))
+        if not lines:
+            return
+
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            for message in pack_lines(lines):
+                if await self.send(channel, message):
+                    self.batches_sent += 1
+                else:
+                    self.dropped += message.count("\n") + 1
+                    ACK_DROPPED.inc(message.count("\n") + 1)
+
+    async def drain(self):
+        """Send everything queued right away, e.g. before shutdown."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        self._tasks.clear()
+        await asyncio.gather(*(self._send_batch(channel_id, 0) for channel_id in list(self._pending)))
+
+    def stats(self):
+        return {"depth": self.depth(), "dropped": self.dropped, "batches_sent": self.batches_sent}
@@ -0,0 +1,130 @@
+from metrics import CACHE_REQUESTS
+
+MEDALS = ["🥇", "🥈", "🥉"]
+
+
+# --- Leaderboard Rendering ---
+def rank_entries(entries, score_key):
+    """Yield (rank, item) for (user_id, entry) pairs sorted by score; tied scores share a rank."""
+    current_rank = 1
+    prev_score = None
+    for idx, (uid, entry) in enumerate(entries):
+        # Handle ties - players with same score get same rank
+        if prev_score is not None and entry[score_key] != prev_score:
+            current_rank = idx + 1
+        yield current_rank, (uid, entry)
+        prev_score = entry[score_key]
+
+def medal_for(rank):
+    return MEDALS[rank - 1] if rank <= 3 else "•"
+
+def render_daily(puzzle_key, scores, title="Leaderboard", mention=False):
+    """Render one puzzle's results. mention=True tags players instead of naming them."""
+    sorted_scores = sorted(scores.items(), key=lambda x: x[1]["guesses"])
+    lines = [f"🏆 {title} for Puzzle #{puzzle_key} 🏆\n"]
+
+    for rank, (uid, entry) in rank_entries(sorted_scores, "guesses"):
+        # Handle both old and new data formats for backward compatibility
+        if entry.get('status', 'complete') == 'complete':
+            # Old format has no status field - assume complete
+            medal = medal_for(rank)
+            status_display = f"{entry['guesses']} guesses"
+        else:
+            medal = "💀"  # Skull emoji for incomplete puzzles
+            status_display = f"❌ INCOMPLETE ({entry.get('connections_solved', 0)}/4)"
+
+        player = f"<@{uid}>" if mention else f"{entry['name']}:"
+        lines.append(f"{medal} {player} {status_display}\n")
+
+    return "".join(lines)
+
+def render_standings(header, total_puzzles, standings, mention=False):
+    """Render a header line followed by ranked (user_id, totals) pairs with a total_score."""
+    lines = [f"{header}\n"]
+
+    for rank, (uid, entry) in rank_entries(standings, "total_score"):
+        complete = entry.get('complete_puzzles', entry['puzzles_played'])  # Backward compatibility
+        incomplete = entry.get('incomplete_puzzles', 0)
+        player = f"<@{uid}>" if mention else entry['name']
+        lines.append(f"{medal_for(rank)} {player}: {entry['total_score']} total ({complete}✅/{incomplete}❌ of {total_puzzles} puzzles)\n")
+
+    return "".join(lines)
+
+def render_weekly(puzzles, standings, mention=False):
+    """Render weekly standings: (user_id, totals) pairs as produced by WeeklyWindow.standings()."""
+    total_puzzles = len(puzzles)
+    header = f"🏆 Weekly Leaderboard (Last {total_puzzles} puzzles: #{puzzles[0]}-#{puzzles[-1]}) 🏆"
+    return render_standings(header, total_puzzles, standings, mention)
+
+def render_range(title, total_puzzles, first, last, standings):
+    """Render standings over a puzzle range, as produced by GuildIndexes.range_standings().
+
+    total_puzzles, first and last are as returned by GuildIndexes.range_span().
+    """
+    header = f"🏆 {title} ({total_puzzles} puzzles: #{first}-#{last}) 🏆"
+    return render_standings(header, total_puzzles, standings)
+
+def render_combined(puzzle_key, scores, puzzles, standings):
+    """Render the Sunday post: tagged final daily board followed by the tagged weekly board."""
+    daily_msg = render_daily(puzzle_key, scores, title="Final Leaderboard", mention=True)
+    if puzzles:
+        weekly_msg = render_weekly(puzzles, standings, mention=True).rstrip("\n")
+    else:
+        weekly_msg = "No puzzles available for weekly leaderboard."
+    return f"{daily_msg}\n\n{weekly_msg}"
+
+def render_stats(stats, bar_width=10):
+    """Render a player's stats as produced by UserHistory.stats()."""
+    lines = [f"📊 Stats for {stats['name']}"]
+    lines.append(
+        f"Puzzles played: {stats['played']} ({stats['completed']}✅/{stats['failed']}❌, "
+        f"{stats['completion_rate']:.0%} complete)"
+    )
+    if stats['average_guesses'] is not None:
+        lines.append(f"Average guesses when complete: {stats['average_guesses']:.2f}")
+    lines.append(f"Average score: {stats['average_score']:.2f}")
+    lines.append(f"🔥 Current streak: {stats['current_streak']} | Best streak: {stats['best_streak']}")
+
+    histogram = stats['guess_histogram']
+    if histogram or stats['failed']:
+        lines.append("Guesses:")
+        largest = max(list(histogram.values()) + [stats['failed']])
+        rows = [(str(guesses), count) for guesses, count in histogram.items()] + [("❌", stats['failed'])]
+        for label, count in rows:
+            bar = "█" * max(1, round(bar_width * count / largest)) if count else ""
+            lines.append(f"`{label:>2}` {bar} {count}")
+    return "\n".join(lines)
+
+def render_history(name, results):
+    """Render (puzzle, score, guesses, solved) tuples as from UserHistory.recent()."""
+    lines = [f"📜 Recent results for {name}"]
+    for puzzle, score, guesses, solved in results:
+        if solved == 4:
+            lines.append(f"#{puzzle}: {guesses} guesses")
+        else:
+            lines.append(f"#{puzzle}: ❌ {solved}/4 connections (score {score})")
+    return "\n".join(lines)
+
+
+# --- Rendered Message Cache ---
+class RenderCache:
+    """Rendered leaderboard text per (guild, view key).
+
+    Entries are tagged with the guild's data version from the store, so the first
+    lookup after a new submission drops everything cached for that guild.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get_or_render(self, guild_id, version, key, render):
+        cached_version, views = self._entries.get(guild_id, (None, None))
+        if cached_version != version:
+            views = {}
+            self._entries[guild_id] = (version, views)
+        if key not in views:
+            CACHE_REQUESTS.inc(cache="render", result="miss")
+            views[key] = render()
+        else:
+            CACHE_REQUESTS.inc(cache="render", result="hit")
+        return views[key]
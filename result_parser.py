@@ -0,0 +1,69 @@
+import re
+from collections import namedtuple
+
+from indexes import latest_puzzle_number
+
+# --- NYT Connections Result Parsing ---
+# Compiled once at import; on_message runs against every message in the channel.
+PUZZLE_PATTERN = re.compile(r'Puzzle #(\d+)')
+SQUARE_PATTERN = re.compile(r'[🟩🟦🟧🟨🟪]')
+FULL_GROUP_PATTERN = re.compile(r'(🟩{4}|🟦{4}|🟧{4}|🟨{4}|🟪{4})')
+# Leaderboard score for a result that didn't solve all four groups
+INCOMPLETE_PENALTY = 10
+
+
+class ConnectionsResult(namedtuple("ConnectionsResult", "puzzle rows solved_groups")):
+    """A parsed result: puzzle key, the guess rows as posted, and the colour of each solved group."""
+
+    __slots__ = ()
+
+    @property
+    def guesses(self):
+        return len(self.rows)
+
+    @property
+    def connections_solved(self):
+        return len(self.solved_groups)
+
+    @property
+    def is_complete(self):
+        return self.connections_solved >= 4
+
+
+def parse_result(content):
+    """Parse a shared Connections result in a single pass. Returns None for anything else."""
+    # Fast rejection for ordinary chatter: no regex work unless the marker is there
+    if "Puzzle #" not in content:
+        return None
+    match = PUZZLE_PATTERN.search(content)
+    if not match:
+        return None
+    # Anything past the newest puzzle is a typo or a prank, and can't be indexed
+    if not 1 <= int(match.group(1)) <= latest_puzzle_number():
+        return None
+
+    rows = []
+    solved_groups = []
+    for line in content.splitlines():
+        if SQUARE_PATTERN.search(line):
+            rows.append(line)
+            # A solved group is a line of exactly four squares of one colour
+            group = FULL_GROUP_PATTERN.fullmatch(line.strip())
+            if group:
+                solved_groups.append(group.group(1)[0])
+
+    if not rows:
+        return None
+    return ConnectionsResult(match.group(1), tuple(rows), tuple(solved_groups))
+
+
+def result_entry(result, name, timestamp):
+    """The leaderboard entry recorded for a parsed result; timestamp is a datetime."""
+    return {
+        "name": name,
+        "guesses": result.guesses if result.is_complete else INCOMPLETE_PENALTY,
+        "status": "complete" if result.is_complete else "incomplete",
+        "connections_solved": result.connections_solved,
+        "actual_guesses": result.guesses,
+        "timestamp": timestamp.isoformat()
+    }
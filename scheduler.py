@@ -0,0 +1,144 @@
+import os
+import asyncio
+import datetime
+import traceback
+
+from indexes import guild_timezone
+
+# Local time of the end-of-day post for guilds that haven't set their own
+DEFAULT_POST_TIME = os.getenv("DAILY_POST_TIME", "21:00")
+# A post missed while the bot was down is still sent if it comes back within this many hours
+CATCH_UP_HOURS = float(os.getenv("DAILY_POST_CATCH_UP_HOURS", "12"))
+# Upper bound on a single sleep, so a stalled clock or lost wake-up can't stall posts for long
+MAX_SLEEP_SECONDS = 3600
+
+
+# --- Schedule Arithmetic ---
+def parse_post_time(value):
+    """Parse "HH:MM" (24-hour) into a datetime.time. Raises ValueError if malformed."""
+    return datetime.datetime.strptime(value, "%H:%M").time()
+
+def guild_post_time(settings):
+    try:
+        return parse_post_time(settings.get("post_time") or DEFAULT_POST_TIME)
+    except ValueError:
+        return parse_post_time(DEFAULT_POST_TIME)
+
+def due_at(settings, local_date):
+    """The UTC instant of a guild's post for the given local date."""
+    local = datetime.datetime.combine(local_date, guild_post_time(settings), tzinfo=guild_timezone(settings))
+    return local.astimezone(datetime.timezone.utc)
+
+def latest_occurrence(settings, now):
+    """(local date, UTC due time) of the most recent post at or before now."""
+    local_date = now.astimezone(guild_timezone(settings)).date()
+    due = due_at(settings, local_date)
+    if due > now:
+        local_date -= datetime.timedelta(days=1)
+        due = due_at(settings, local_date)
+    return local_date, due
+
+def next_occurrence(settings, now):
+    """(local date, UTC due time) of the first post strictly after now."""
+    local_date, due = latest_occurrence(settings, now)
+    local_date += datetime.timedelta(days=1)
+    return local_date, due_at(settings, local_date)
+
+def due_post_date(settings, now):
+    """The local date whose post should go out now, or None.
+
+    That is the latest occurrence, unless it was already posted (settings["last_posted"])
+    or it is more than CATCH_UP_HOURS old. DailyScheduler seeds last_posted before
+    calling this, so a guild it has never scheduled doesn't count as never posted.
+    """
+    local_date, due = latest_occurrence(settings, now)
+    last_posted = settings.get("last_posted")
+    if last_posted and last_posted >= local_date.isoformat():
+        return None
+    if now - due > datetime.timedelta(hours=CATCH_UP_HOURS):
+        return None
+    return local_date
+
+
+# --- Scheduler ---
+class DailyScheduler:
+    """Sleeps until the next guild's end-of-day post is due, then hands every due guild to `post`.
+
+    `post(due)` receives [(guild, local_date), ...] and must record last_posted for each
+    before sending, which is what makes posts idempotent across restarts. Call
+    change_schedule() to change a guild's post time, and reschedule() after a guild is added.
+    """
+
+    def __init__(self, get_guilds, store, post):
+        self.get_guilds = get_guilds
+        self.store = store
+        self.post = post
+        self._wake = asyncio.Event()
+
+    def reschedule(self):
+        self._wake.set()
+
+    async def run_once(self, now=None):
+        """Post whatever is due at `now`. Returns the UTC time of the next post, or None."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        guilds = list(self.get_guilds())
+        await asyncio.gather(*(self.seed_last_posted(guild.id, now) for guild in guilds))
+        due = []
+        next_at = None
+        for guild in guilds:
+            settings = await self.store.get_settings(guild.id)
+            local_date = due_post_date(settings, now)
+            if local_date:
+                due.append((guild, local_date))
+            upcoming = next_occurrence(settings, now)[1]
+            next_at = upcoming if next_at is None else min(next_at, upcoming)
+        if due:
+            await self.post(due)
+        return next_at
+
+    async def seed_last_posted(self, guild_id, now):
+        """Treat the latest occurrence as posted for a guild this scheduler hasn't seen before.
+
+        The old polling loop (or the guild's first day with the bot) may already have
+        covered it, so catching up could post the same day twice.
+        """
+        settings = await self.store.get_settings(guild_id)
+        if "last_posted" not in settings:
+            local_date = latest_occurrence(settings, now)[0]
+            await self.store.update_settings(guild_id, {"last_posted": local_date.isoformat()})
+
+    async def change_schedule(self, guild_id, changes, now=None):
+        """Apply post time/timezone changes so the new schedule starts at its next occurrence.
+
+        last_posted moves up to the latest occurrence under the new schedule; otherwise
+        moving the time earlier than now would post the current day straight away.
+        Returns the updated settings.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        settings = dict(await self.store.get_settings(guild_id), **changes)
+        local_date = latest_occurrence(settings, now)[0].isoformat()
+        if settings.get("last_posted", "") < local_date:
+            changes = dict(changes, last_posted=local_date)
+        settings = await self.store.update_settings(guild_id, changes)
+        self.reschedule()
+        return settings
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            try:
+                next_at = await self.run_once()
+            except Exception as e:
+                print(f"Error in daily leaderboard scheduler: {e}")
+                traceback.print_exc()
+                next_at = None
+
+            if next_at is None:
+                delay = MAX_SLEEP_SECONDS
+            else:
+                delay = (next_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+                delay = min(max(delay, 0), MAX_SLEEP_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
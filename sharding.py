@@ -0,0 +1,159 @@
+"""Run the bot as several shard processes that share one storage backend.
+
+    python sharding.py run --shards 4 --processes 2     # two processes, shards 0-1 and 2-3
+    python sharding.py simulate --shards 4 --guilds 200 # offline check, no Discord connection
+
+Each process gets SHARD_COUNT and SHARD_IDS in its environment and bot.py builds an
+AutoShardedBot for just those shards. Discord routes every guild to exactly one shard,
+so each guild's in-memory cache lives in one process; processes must share storage
+(STORAGE_BACKEND=sqlite, or a shared directory for JSON files) so daily-post claims
+are visible cluster-wide.
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import datetime
+import tempfile
+import subprocess
+import multiprocessing
+
+
+# --- Shard Configuration ---
+def shard_config_from_env():
+    """(shard_count, shard_ids) from SHARD_COUNT / SHARD_IDS, or (None, None) for a single unsharded bot."""
+    shard_count = int(os.getenv("SHARD_COUNT", "0")) or None
+    shard_ids = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+    return shard_count, shard_ids
+
+def shard_for_guild(guild_id, shard_count):
+    """The shard Discord routes a guild to (see the Discord sharding docs)."""
+    return (guild_id >> 22) % shard_count
+
+def split_shards(shard_count, processes):
+    """Spread shard IDs over processes as evenly as possible, keeping each process's IDs contiguous."""
+    per_process, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for index in range(processes):
+        size = per_process + (1 if index < extra else 0)
+        groups.append(list(range(start, start + size)))
+        start += size
+    return [group for group in groups if group]
+
+
+# --- Launcher ---
+def run_cluster(shard_count, processes):
+    """Start one bot.py per shard group and stop them all if any exits or on Ctrl+C."""
+    children = []
+    for shard_ids in split_shards(shard_count, processes):
+        env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, shard_ids)))
+        print(f"Starting shard process for shards {shard_ids}")
+        bot_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+        children.append(subprocess.Popen([sys.executable, bot_script], env=env))
+
+    try:
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signal.SIGINT)
+        for child in children:
+            child.wait()
+    return max((child.returncode or 0) for child in children)
+
+
+# --- Offline Simulation ---
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+def _simulate_shard(db_path, shard_count, shard_ids, guild_ids, now, results):
+    """One shard process: a stand-in gateway that hands the scheduler only this shard's guilds."""
+    from storage import LeaderboardStore
+    from scheduler import DailyScheduler
+    from sqlite_storage import SqliteBackend
+
+    async def main():
+        store = LeaderboardStore(SqliteBackend(db_path, migrate_json=False))
+        guilds = [FakeGuild(g) for g in guild_ids if shard_for_guild(g, shard_count) in shard_ids]
+        posted = []
+
+        async def post(due):
+            for guild, local_date in due:
+                await store.update_settings(guild.id, {"last_posted": local_date.isoformat()})
+                if await store.claim_daily_post(guild.id, local_date):
+                    posted.append(guild.id)
+
+        await DailyScheduler(lambda: guilds, store, post).run_once(now)
+        store.close()
+        return posted
+
+    results.extend(asyncio.run(main()))
+
+
+def simulate(shard_count, processes, guild_count, duplicate):
+    """Run every shard group as a real process against one SQLite file and check each guild posts once.
+
+    With duplicate=True every group runs twice, as during a rolling restart.
+    """
+    guild_ids = [(index + 1) << 22 | index for index in range(guild_count)]
+    now = datetime.datetime.now(datetime.timezone.utc).replace(hour=21, minute=0, second=0, microsecond=0)
+    groups = split_shards(shard_count, processes) * (2 if duplicate else 1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "shared.db")
+        from sqlite_storage import SqliteBackend
+        from scheduler import latest_occurrence
+        # Create the schema once up front, with every guild last posted the day before, as
+        # DailyScheduler would otherwise treat today's post as already covered for new guilds
+        backend = SqliteBackend(db_path, migrate_json=False)
+        yesterday = latest_occurrence({}, now)[0] - datetime.timedelta(days=1)
+        for guild_id in guild_ids:
+            backend.save_settings(guild_id, {"last_posted": yesterday.isoformat()})
+        backend.close()
+
+        with multiprocessing.Manager() as manager:
+            results = manager.list()
+            workers = [
+                multiprocessing.Process(target=_simulate_shard, args=(db_path, shard_count, group, guild_ids, now, results))
+                for group in groups
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            posted = list(results)
+
+    missing = set(guild_ids) - set(posted)
+    doubled = len(posted) - len(set(posted))
+    print(f"{len(workers)} shard processes, {guild_count} guilds: {len(set(posted))} posted, "
+          f"{len(missing)} missing, {doubled} duplicate posts")
+    return 0 if not missing and not doubled else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run or simulate a sharded bot cluster.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    run = subcommands.add_parser("run", help="start the shard processes")
+    sim = subcommands.add_parser("simulate", help="check daily posts go out exactly once, offline")
+    for sub in (run, sim):
+        sub.add_argument("--shards", type=int, required=True, help="total shard count")
+        sub.add_argument("--processes", type=int, default=1, help="number of processes to spread the shards over")
+    sim.add_argument("--guilds", type=int, default=100)
+    sim.add_argument("--no-duplicate", action="store_true", help="don't run a second copy of each shard group")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        return run_cluster(args.shards, args.processes)
+    return simulate(args.shards, args.processes, args.guilds, duplicate=not args.no_duplicate)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+import sys
+import glob
+import json
+import re
+import sqlite3
+import threading
+
+from storage import StorageBackend, JsonFileBackend, archive_puzzles
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    guild_id INTEGER NOT NULL,
+    puzzle INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    name TEXT,
+    guesses INTEGER,
+    status TEXT,
+    connections_solved INTEGER,
+    actual_guesses INTEGER,
+    timestamp TEXT,
+    PRIMARY KEY (guild_id, puzzle, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS streaks (
+    guild_id INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS archives (
+    guild_id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS daily_posts (
+    guild_id INTEGER NOT NULL,
+    post_date TEXT NOT NULL,
+    PRIMARY KEY (guild_id, post_date)
+);
+
+CREATE TABLE IF NOT EXISTS migrated_guilds (
+    guild_id INTEGER PRIMARY KEY
+);
+"""
+
+# Leaderboard entry keys, in column order. Missing keys are stored as NULL and left
+# out again on load, so old-format entries (no status/timestamp) round-trip unchanged.
+ENTRY_FIELDS = ("name", "guesses", "status", "connections_solved", "actual_guesses", "timestamp")
+
+
+def rows_to_leaderboard(rows):
+    """Build a leaderboard dict from (puzzle, user_id, *ENTRY_FIELDS) rows."""
+    leaderboard = {}
+    for puzzle, user_id, *values in rows:
+        entry = {key: value for key, value in zip(ENTRY_FIELDS, values) if value is not None}
+        leaderboard.setdefault(str(puzzle), {})[user_id] = entry
+    return leaderboard
+
+
+class SqliteBackend(StorageBackend):
+    """All guilds in one SQLite database, one row per submission.
+
+    Guilds that still have JSON files are imported the first time they are loaded.
+    Several shard processes can share one database file: WAL mode lets readers run
+    alongside the single writer, and writers wait up to `timeout` seconds for the lock.
+    """
+
+    def __init__(self, path, migrate_json=True, timeout=30):
+        self.path = path
+        self.migrate_json = migrate_json
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def load_guild(self, guild_id):
+        if self.migrate_json:
+            self.migrate_guild(guild_id)
+
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT puzzle, user_id, {', '.join(ENTRY_FIELDS)} FROM submissions "
+                "WHERE guild_id = ? ORDER BY rowid",
+                (guild_id,),
+            ).fetchall()
+            streak_rows = self.conn.execute(
+                "SELECT user_id, value FROM streaks WHERE guild_id = ?", (guild_id,)
+            ).fetchall()
+            archive = self._load_archive(guild_id)
+
+        streaks = {user_id: json.loads(value) for user_id, value in streak_rows}
+        return rows_to_leaderboard(rows), streaks, archive, False
+
+    def append(self, guild_id, record):
+        return self.append_many(guild_id, [record])
+
+    def append_many(self, guild_id, records):
+        # One transaction, so one commit (and fsync) however many records
+        with self._lock, self.conn:
+            for record in records:
+                self._apply(guild_id, record)
+        return False
+
+    def _apply(self, guild_id, record):
+        op = record.get("op")
+        if op == "submit":
+            self._insert_submission(guild_id, record["puzzle"], record["user_id"], record["entry"])
+        elif op == "streak":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO streaks (guild_id, user_id, value) VALUES (?, ?, ?)",
+                (guild_id, record["user_id"], json.dumps(record["streak"])),
+            )
+        elif op == "archive":
+            rows = self.conn.execute(
+                f"SELECT puzzle, user_id, {', '.join(ENTRY_FIELDS)} FROM submissions WHERE guild_id = ? AND puzzle < ?",
+                (guild_id, record["before"]),
+            ).fetchall()
+            archive = self._load_archive(guild_id)
+            archive_puzzles(rows_to_leaderboard(rows), archive, record["before"])
+            self._save_archive(guild_id, archive)
+            self.conn.execute("DELETE FROM submissions WHERE guild_id = ? AND puzzle < ?", (guild_id, record["before"]))
+        elif op == "restore_archive":
+            self._save_archive(guild_id, record["archive"])
+        elif op == "clear":
+            self.conn.execute("DELETE FROM submissions WHERE guild_id = ?", (guild_id,))
+            self.conn.execute("DELETE FROM streaks WHERE guild_id = ?", (guild_id,))
+            self.conn.execute("DELETE FROM archives WHERE guild_id = ?", (guild_id,))
+
+    def _load_archive(self, guild_id):
+        row = self.conn.execute("SELECT value FROM archives WHERE guild_id = ?", (guild_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def _save_archive(self, guild_id, archive):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO archives (guild_id, value) VALUES (?, ?)", (guild_id, json.dumps(archive))
+        )
+
+    def _insert_submission(self, guild_id, puzzle, user_id, entry):
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO submissions (guild_id, puzzle, user_id, {', '.join(ENTRY_FIELDS)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in ENTRY_FIELDS)})",
+            (guild_id, int(puzzle), user_id, *(entry.get(key) for key in ENTRY_FIELDS)),
+        )
+
+    def load_settings(self, guild_id):
+        # The scheduler can read settings before anything loads the guild
+        if self.migrate_json:
+            self.migrate_guild(guild_id)
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM guild_settings WHERE guild_id = ?", (guild_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_settings(self, guild_id, settings):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO guild_settings (guild_id, value) VALUES (?, ?)",
+                (guild_id, json.dumps(settings)),
+            )
+
+    def claim_daily_post(self, guild_id, post_date):
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO daily_posts (guild_id, post_date) VALUES (?, ?)", (guild_id, post_date)
+            )
+        return cursor.rowcount == 1
+
+    def describe(self, guild_id):
+        return f"{self.path} (guild {guild_id})"
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # --- Migration ---
+    def migrate_guild(self, guild_id):
+        """Import a guild's JSON snapshot and journal once. Returns True if anything was imported."""
+        with self._lock:
+            if self.conn.execute("SELECT 1 FROM migrated_guilds WHERE guild_id = ?", (guild_id,)).fetchone():
+                return False
+
+        json_backend = JsonFileBackend()
+        leaderboard, streaks, archive, _ = json_backend.load_guild(guild_id)
+        settings = json_backend.load_settings(guild_id)
+        with self._lock, self.conn:
+            for puzzle, scores in leaderboard.items():
+                for user_id, entry in scores.items():
+                    self._insert_submission(guild_id, puzzle, user_id, entry)
+            for user_id, streak in streaks.items():
+                self._apply(guild_id, {"op": "streak", "user_id": user_id, "streak": streak})
+            if archive:
+                self._save_archive(guild_id, archive)
+            if settings:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO guild_settings (guild_id, value) VALUES (?, ?)",
+                    (guild_id, json.dumps(settings)),
+                )
+            self.conn.execute("INSERT OR IGNORE INTO migrated_guilds (guild_id) VALUES (?)", (guild_id,))
+        return bool(leaderboard or streaks or archive or settings)
+
+
+def migrate_json_files(backend):
+    """Import every leaderboard_*/streaks_*/archive_*/settings_*/journal_* guild in the working directory."""
+    guild_ids = set()
+    for pattern in ("leaderboard_*.json", "streaks_*.json", "archive_*.json", "settings_*.json", "journal_*.jsonl"):
+        for file in glob.glob(pattern):
+            match = re.search(r"_(\d+)\.json", file)
+            if match:
+                guild_ids.add(int(match.group(1)))
+
+    migrated = [guild_id for guild_id in sorted(guild_ids) if backend.migrate_guild(guild_id)]
+    return migrated
+
+
+if __name__ == "__main__":
+    # Usage: python sqlite_storage.py [database path]
+    from storage import SQLITE_PATH
+    backend = SqliteBackend(sys.argv[1] if len(sys.argv) > 1 else SQLITE_PATH)
+    migrated = migrate_json_files(backend)
+    print(f"Migrated {len(migrated)} guild(s) into {backend.path}: {', '.join(map(str, migrated)) or 'none'}")
+    backend.close()
@@ -0,0 +1,577 @@
+import os
+import json
+import asyncio
+import glob
+import time
+
+from indexes import GuildIndexes, guild_timezone, new_summary, add_to_summary, streak_runs, check_submission
+from metrics import STORAGE_SECONDS, STORAGE_BYTES, CACHE_REQUESTS
+
+# Seconds to wait after a journal fills up before compacting it into a snapshot
+FLUSH_DELAY_SECONDS = float(os.getenv("LEADERBOARD_FLUSH_DELAY", "5"))
+# Journal length (in records) at which a guild is compacted into fresh snapshots
+JOURNAL_COMPACT_LINES = int(os.getenv("JOURNAL_COMPACT_LINES", "500"))
+# "json" (snapshot files + journal) or "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "leaderboard.db")
+# Puzzles kept in full per guild; older ones are folded into per-player summaries. 0 keeps everything.
+RETENTION_PUZZLES = int(os.getenv("RETENTION_PUZZLES", "0"))
+# Smallest retention allowed, so the weekly and monthly boards always see full results
+MIN_RETENTION_PUZZLES = 31
+
+# --- Leaderboard Files ---
+def get_leaderboard_file(guild_id):
+    return f"leaderboard_{guild_id}.json"
+
+def get_streaks_file(guild_id):
+    return f"streaks_{guild_id}.json"
+
+def get_journal_file(guild_id):
+    return f"journal_{guild_id}.jsonl"
+
+def get_archive_file(guild_id):
+    return f"archive_{guild_id}.json"
+
+def get_settings_file(guild_id):
+    return f"settings_{guild_id}.json"
+
+def get_daily_post_claim_file(guild_id, post_date):
+    return f"posted_{guild_id}_{post_date}.claim"
+
+def write_json_atomic(file, data):
+    """Write JSON to a temp file and rename it over the target so readers never see a partial file."""
+    tmp_file = f"{file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+        STORAGE_BYTES.inc(f.tell(), direction="write")
+    os.replace(tmp_file, file)
+
+def read_json(file):
+    """Load a JSON file, or {} if it doesn't exist."""
+    if not os.path.exists(file):
+        return {}
+    with open(file, "r") as f:
+        data = json.load(f)
+        STORAGE_BYTES.inc(f.tell(), direction="read")
+    return data
+
+def load_leaderboard(guild_id):
+    return read_json(get_leaderboard_file(guild_id))
+
+def save_leaderboard(guild_id, data):
+    write_json_atomic(get_leaderboard_file(guild_id), data)
+
+def load_streaks(guild_id):
+    return read_json(get_streaks_file(guild_id))
+
+def save_streaks(guild_id, data):
+    write_json_atomic(get_streaks_file(guild_id), data)
+
+def load_archive(guild_id):
+    return read_json(get_archive_file(guild_id))
+
+def save_archive(guild_id, data):
+    write_json_atomic(get_archive_file(guild_id), data)
+
+def load_settings(guild_id):
+    return read_json(get_settings_file(guild_id))
+
+def save_settings(guild_id, data):
+    write_json_atomic(get_settings_file(guild_id), data)
+
+
+# --- Submission Journal ---
+# One JSON record per line, appended after each change and replayed on top of the
+# snapshots on load. Records are idempotent, so replaying a journal that was already
+# folded into a snapshot (crash between snapshot and truncate) is harmless.
+def append_journal(guild_id, *records):
+    """Append records to the guild's journal with a single write."""
+    lines = "".join(json.dumps(record) + "\n" for record in records)
+    with open(get_journal_file(guild_id), "a") as f:
+        f.write(lines)
+    STORAGE_BYTES.inc(len(lines), direction="write")
+
+def read_journal(guild_id):
+    """Yield journal records in order, skipping a torn final line from a crash mid-append."""
+    file = get_journal_file(guild_id)
+    if not os.path.exists(file):
+        return
+    line = "\n"
+    with open(file, "r") as f:
+        for line in f:
+            STORAGE_BYTES.inc(len(line), direction="read")
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"Skipping unreadable journal line for guild {guild_id}")
+    if not line.endswith("\n"):
+        # Terminate the torn line so the next append starts on a fresh one
+        with open(file, "a") as f:
+            f.write("\n")
+
+def truncate_journal(guild_id):
+    open(get_journal_file(guild_id), "w").close()
+
+def apply_journal_record(leaderboard, streaks, archive, record):
+    op = record.get("op")
+    if op == "submit":
+        leaderboard.setdefault(record["puzzle"], {})[record["user_id"]] = record["entry"]
+    elif op == "streak":
+        streaks[record["user_id"]] = record["streak"]
+    elif op == "archive":
+        archive_puzzles(leaderboard, archive, record["before"])
+    elif op == "restore_archive":
+        archive.clear()
+        archive.update(record["archive"])
+    elif op == "clear":
+        # Streak state is derived from the leaderboard, so it goes too
+        leaderboard.clear()
+        streaks.clear()
+        archive.clear()
+
+def check_record(record):
+    """Raise ValueError for a journal record that couldn't be applied to a guild."""
+    op = record.get("op")
+    if op == "submit":
+        if not isinstance(record.get("user_id"), str):
+            raise ValueError(f"bad user ID {record.get('user_id')!r}")
+        check_submission(record.get("puzzle"), record.get("entry"))
+    elif op not in ("streak", "archive", "restore_archive", "clear"):
+        raise ValueError(f"unknown journal operation {op!r}")
+
+def archive_puzzles(leaderboard, archive, before):
+    """Move every puzzle below `before` out of the leaderboard and into per-player summaries.
+
+    The archive is {"before", "first", "last", "puzzles", "users": {user_id: summary}}.
+    Puzzles already below the archive's previous "before" were counted when it was
+    written (a crash between saving the archive and the leaderboard snapshot), so
+    replaying an archive record only drops them again.
+    """
+    watermark = archive.get("before", 0)
+    users = archive.setdefault("users", {})
+    for puzzle_num in sorted(int(k) for k in leaderboard if int(k) < before):
+        scores = leaderboard.pop(str(puzzle_num))
+        if puzzle_num < watermark or not scores:
+            continue
+        archive["puzzles"] = archive.get("puzzles", 0) + 1
+        archive["first"] = min(archive.get("first", puzzle_num), puzzle_num)
+        archive["last"] = max(archive.get("last", puzzle_num), puzzle_num)
+        for user_id, entry in scores.items():
+            if user_id not in users:
+                users[user_id] = new_summary(entry['name'])
+            add_to_summary(users[user_id], puzzle_num, entry)
+    archive["before"] = max(before, watermark)
+
+
+# --- Storage Backends ---
+class StorageBackend:
+    """Where guild data is persisted. The store keeps a copy of each guild in memory
+    and answers queries from it.
+    """
+
+    def load_guild(self, guild_id):
+        """Return (leaderboard, streaks, archive, needs_compaction) for a guild."""
+        raise NotImplementedError
+
+    def append(self, guild_id, record):
+        """Persist one journal record. Returns True once compact() should be called."""
+        raise NotImplementedError
+
+    def append_many(self, guild_id, records):
+        """Persist several records at once; backends override this to batch the write."""
+        needs_compaction = False
+        for record in records:
+            needs_compaction = self.append(guild_id, record) or needs_compaction
+        return needs_compaction
+
+    def compact(self, guild_id, leaderboard, streaks, archive):
+        pass
+
+    def needs_flush(self, guild_id):
+        """True if the guild has records that compact() should fold away before shutdown."""
+        return False
+
+    def load_settings(self, guild_id):
+        """Per-guild settings (post time, timezone, ...) as a dict."""
+        raise NotImplementedError
+
+    def save_settings(self, guild_id, settings):
+        raise NotImplementedError
+
+    def claim_daily_post(self, guild_id, post_date):
+        """Atomically claim a guild's post for a date (ISO string). Only the first caller, in any process, gets True."""
+        raise NotImplementedError
+
+    def describe(self, guild_id):
+        """Human-readable location of a guild's data."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonFileBackend(StorageBackend):
+    """leaderboard_/streaks_ snapshot files plus an append-only journal per guild."""
+
+    def __init__(self, compact_threshold=JOURNAL_COMPACT_LINES):
+        self.compact_threshold = compact_threshold
+        self._journal_lines = {}
+
+    def load_guild(self, guild_id):
+        leaderboard = load_leaderboard(guild_id)
+        streaks = load_streaks(guild_id)
+        archive = load_archive(guild_id)
+        replayed = 0
+        for record in read_journal(guild_id):
+            apply_journal_record(leaderboard, streaks, archive, record)
+            replayed += 1
+        self._journal_lines[guild_id] = replayed
+        return leaderboard, streaks, archive, replayed >= self.compact_threshold
+
+    def append(self, guild_id, record):
+        return self.append_many(guild_id, [record])
+
+    def append_many(self, guild_id, records):
+        append_journal(guild_id, *records)
+        self._journal_lines[guild_id] = self._journal_lines.get(guild_id, 0) + len(records)
+        return self._journal_lines[guild_id] >= self.compact_threshold
+
+    def compact(self, guild_id, leaderboard, streaks, archive):
+        """Write fresh snapshots for a guild and empty its journal."""
+        # Archive first: replaying an archive record over an older leaderboard is safe, the reverse loses data
+        if archive or os.path.exists(get_archive_file(guild_id)):
+            save_archive(guild_id, archive)
+        save_leaderboard(guild_id, leaderboard)
+        save_streaks(guild_id, streaks)
+        truncate_journal(guild_id)
+        self._journal_lines[guild_id] = 0
+
+    def needs_flush(self, guild_id):
+        return self._journal_lines.get(guild_id, 0) > 0
+
+    def load_settings(self, guild_id):
+        return load_settings(guild_id)
+
+    def save_settings(self, guild_id, settings):
+        save_settings(guild_id, settings)
+
+    def claim_daily_post(self, guild_id, post_date):
+        # O_EXCL creation is atomic across processes sharing the directory
+        try:
+            os.close(os.open(get_daily_post_claim_file(guild_id, post_date), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        # Older claims can never be contested again
+        for file in glob.glob(get_daily_post_claim_file(guild_id, "*")):
+            if file != get_daily_post_claim_file(guild_id, post_date):
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+        return True
+
+    def describe(self, guild_id):
+        return get_leaderboard_file(guild_id)
+
+
+def create_backend(name=STORAGE_BACKEND):
+    """Build the backend selected by STORAGE_BACKEND."""
+    if name == "sqlite":
+        from sqlite_storage import SqliteBackend
+        return SqliteBackend(SQLITE_PATH)
+    if name == "json":
+        return JsonFileBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+# --- In-Memory Store ---
+class LeaderboardStore:
+    """Per-guild leaderboard and streak cache in front of a StorageBackend.
+
+    Each guild is loaded from the backend once and every later read is served from
+    memory. Writes hand a single record to the backend (a journal line or a row), so
+    recording a submission costs O(1) no matter how much history exists. When the
+    backend asks for compaction it runs FLUSH_DELAY_SECONDS later, and flush()
+    compacts everything at shutdown.
+
+    Backend I/O runs in the default executor so the event loop never blocks on disk.
+    Callers that read, decide and then write (e.g. "has this user already submitted?")
+    must hold lock(guild_id) for the whole sequence; compaction takes the same lock.
+    """
+
+    def __init__(self, backend=None, flush_delay=FLUSH_DELAY_SECONDS):
+        self.backend = backend if backend is not None else create_backend()
+        self.flush_delay = flush_delay
+        self._leaderboards = {}
+        self._streaks = {}
+        self._archives = {}
+        self._settings = {}
+        self._indexes = {}
+        self._versions = {}
+        self._locks = {}
+        self._loading = {}
+        self._pending = set()
+        self._flush_handle = None
+
+    def lock(self, guild_id):
+        """The asyncio.Lock serialising writes to a guild."""
+        if guild_id not in self._locks:
+            self._locks[guild_id] = asyncio.Lock()
+        return self._locks[guild_id]
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _timed(self, operation, func, *args):
+        """_run(), recording the latency (executor wait included) under connections_storage_seconds."""
+        start = time.perf_counter()
+        try:
+            return await self._run(func, *args)
+        finally:
+            STORAGE_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+    def _load_guild(self, guild_id, tz):
+        # Runs in the executor: read the guild and build its indexes in one pass
+        leaderboard, streaks, archive, needs_compaction = self.backend.load_guild(guild_id)
+        return leaderboard, streaks, archive, needs_compaction, GuildIndexes.build(leaderboard, tz, archive)
+
+    async def _load(self, guild_id):
+        if guild_id in self._leaderboards:
+            CACHE_REQUESTS.inc(cache="guild", result="hit")
+            return
+        CACHE_REQUESTS.inc(cache="guild", result="miss")
+        # Dates in the indexes are guild-local, so settings come first
+        tz = guild_timezone(await self.get_settings(guild_id))
+        # Concurrent first reads of a guild share a single backend load
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = asyncio.ensure_future(self._timed("load", self._load_guild, guild_id, tz))
+            self._loading[guild_id] = task
+        try:
+            leaderboard, streaks, archive, needs_compaction, indexes = await task
+        finally:
+            self._loading.pop(guild_id, None)
+        if guild_id in self._leaderboards:
+            return
+        self._leaderboards[guild_id] = leaderboard
+        self._streaks[guild_id] = streaks
+        self._archives[guild_id] = archive
+        self._indexes[guild_id] = indexes
+        if needs_compaction:
+            self._request_compaction(guild_id)
+
+    async def warm(self, guild_ids):
+        """Load guilds ahead of their first read, one at a time. Returns how many were loaded."""
+        loaded = 0
+        for guild_id in guild_ids:
+            try:
+                await self._load(guild_id)
+                loaded += 1
+            except Exception as e:
+                print(f"Error loading guild {guild_id}: {e}")
+        return loaded
+
+    async def get_leaderboard(self, guild_id):
+        await self._load(guild_id)
+        return self._leaderboards[guild_id]
+
+    async def get_streaks(self, guild_id):
+        await self._load(guild_id)
+        return self._streaks[guild_id]
+
+    async def get_settings(self, guild_id):
+        """The guild's settings dict. Read-only; change it with update_settings()."""
+        if guild_id not in self._settings:
+            settings = await self._timed("load_settings", self.backend.load_settings, guild_id)
+            self._settings.setdefault(guild_id, settings)
+        return self._settings[guild_id]
+
+    async def update_settings(self, guild_id, changes):
+        """Merge changes into the guild's settings and persist them."""
+        async with self.lock(guild_id):
+            old = await self.get_settings(guild_id)
+            settings = dict(old, **changes)
+            await self._timed("save_settings", self.backend.save_settings, guild_id, settings)
+            self._settings[guild_id] = settings
+            if guild_id in self._indexes and settings.get("timezone") != old.get("timezone"):
+                # "Today" moved, so re-bucket submission dates in the new timezone
+                self._indexes[guild_id] = await self._run(
+                    GuildIndexes.build, self._leaderboards[guild_id], guild_timezone(settings), self._archives[guild_id]
+                )
+                self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        return settings
+
+    async def claim_daily_post(self, guild_id, post_date):
+        """True if this process should send the guild's post for post_date; see StorageBackend.claim_daily_post."""
+        return await self._timed("claim", self.backend.claim_daily_post, guild_id, post_date.isoformat())
+
+    async def record_submission(self, guild_id, puzzle, user_id, entry):
+        await self._append(guild_id, {"op": "submit", "puzzle": puzzle, "user_id": user_id, "entry": entry})
+
+    async def set_streak(self, guild_id, user_id, streak):
+        await self._append(guild_id, {"op": "streak", "user_id": user_id, "streak": streak})
+
+    async def clear_leaderboard(self, guild_id):
+        async with self.lock(guild_id):
+            await self._append(guild_id, {"op": "clear"})
+        # Fold the clear into the snapshot soon so the old history stops being replayed
+        self._request_compaction(guild_id)
+
+    async def merge_submissions(self, guild_id, submissions):
+        """Record (puzzle, user_id, entry) results with one backend write, skipping those already known.
+
+        A player's first result for a puzzle wins, whether it is already on the leaderboard
+        or earlier in `submissions`. Archived puzzles and results check_submission()
+        rejects are skipped. Streak state for
+        every player who gained a result is rebuilt in the same write. Takes the guild
+        lock itself. Returns (recorded, skipped).
+        """
+        async with self.lock(guild_id):
+            leaderboard = await self.get_leaderboard(guild_id)
+            indexes = self._indexes[guild_id]
+            records = []
+            added = {}  # user_id -> puzzle numbers recorded now
+            for puzzle, user_id, entry in submissions:
+                try:
+                    check_submission(puzzle, entry)
+                except ValueError:
+                    continue
+                puzzle_num = int(puzzle)
+                if (user_id in leaderboard.get(puzzle, {}) or puzzle_num in added.get(user_id, ())
+                        or puzzle_num < indexes.archived_before()):
+                    continue
+                records.append({"op": "submit", "puzzle": puzzle, "user_id": user_id, "entry": entry})
+                added.setdefault(user_id, set()).add(puzzle_num)
+
+            # Old puzzles can join or split runs, so rebuild each touched player's streak state
+            for user_id, puzzles in added.items():
+                history = indexes.histories.get(user_id)
+                played = sorted(puzzles.union(history.puzzles if history else ()))
+                current, best = streak_runs(played, history.summary if history else None)
+                records.append({
+                    "op": "streak",
+                    "user_id": user_id,
+                    "streak": {"last_puzzle": played[-1], "current": current, "best": best},
+                })
+            if records:
+                await self._append(guild_id, *records)
+        recorded = sum(len(puzzles) for puzzles in added.values())
+        return recorded, len(submissions) - recorded
+
+    async def apply_retention(self, guild_id, keep):
+        """Archive all but the newest `keep` puzzles with results. Returns how many were archived."""
+        keep = max(keep, MIN_RETENTION_PUZZLES)
+        async with self.lock(guild_id):
+            await self._load(guild_id)
+            puzzle_numbers = self._indexes[guild_id].puzzle_numbers
+            if len(puzzle_numbers) <= keep:
+                return 0
+            archived = len(puzzle_numbers) - keep
+            await self._append(guild_id, {"op": "archive", "before": puzzle_numbers[-keep]})
+        # Fold the archived puzzles out of the snapshot soon
+        self._request_compaction(guild_id)
+        return archived
+
+    async def restore_archive(self, guild_id, archive):
+        """Install an imported archive. Only allowed while the guild has no archive and no older results."""
+        async with self.lock(guild_id):
+            await self._load(guild_id)
+            indexes = self._indexes[guild_id]
+            if indexes.archive.get("puzzles") or (indexes.puzzle_numbers and indexes.puzzle_numbers[0] < archive["before"]):
+                return False
+            await self._append(guild_id, {"op": "restore_archive", "archive": archive})
+        return True
+
+    async def archive(self, guild_id):
+        """The guild's archive dict (see archive_puzzles); {} if nothing has been archived."""
+        await self._load(guild_id)
+        return self._archives[guild_id]
+
+    async def _append(self, guild_id, *records):
+        await self._load(guild_id)
+        # A record that can't be applied must never reach the journal, or every later load would fail
+        for record in records:
+            check_record(record)
+        if len(records) == 1:
+            needs_compaction = await self._timed("append", self.backend.append, guild_id, records[0])
+        else:
+            needs_compaction = await self._timed("append_many", self.backend.append_many, guild_id, list(records))
+        for record in records:
+            apply_journal_record(self._leaderboards[guild_id], self._streaks[guild_id], self._archives[guild_id], record)
+            self._indexes[guild_id].apply(self._leaderboards[guild_id], record, self._archives[guild_id])
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        if needs_compaction:
+            self._request_compaction(guild_id)
+
+    def version(self, guild_id):
+        """Counter bumped on every write to a guild, for invalidating derived caches."""
+        return self._versions.get(guild_id, 0)
+
+    # --- Queries ---
+    async def latest_puzzle_on(self, guild_id, date):
+        """Latest puzzle key with a submission timestamped on the given date."""
+        await self._load(guild_id)
+        return self._indexes[guild_id].latest_puzzle_on(date)
+
+    async def weekly_window(self, guild_id):
+        """The guild's rolling WeeklyWindow of recent puzzles and per-user totals."""
+        await self._load(guild_id)
+        return self._indexes[guild_id].weekly
+
+    async def guild_indexes(self, guild_id):
+        """The guild's GuildIndexes, for range standings and other derived queries."""
+        await self._load(guild_id)
+        return self._indexes[guild_id]
+
+    async def user_history(self, guild_id, user_id):
+        """The user's UserHistory, or None if they have no results in this guild."""
+        await self._load(guild_id)
+        return self._indexes[guild_id].histories.get(user_id)
+
+    # --- Compaction ---
+    def _request_compaction(self, guild_id):
+        self._pending.add(guild_id)
+        if self._flush_handle is not None:
+            return  # A compaction is already pending; this guild rides along with it
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(
+            self.flush_delay, lambda: asyncio.ensure_future(self._compact_pending())
+        )
+
+    async def _compact_pending(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, set()
+        for guild_id in pending:
+            try:
+                # Hold the guild lock so the snapshot isn't mutated while it is written
+                async with self.lock(guild_id):
+                    await self._timed(
+                        "compact", self.backend.compact, guild_id,
+                        self._leaderboards[guild_id], self._streaks[guild_id], self._archives[guild_id]
+                    )
+            except Exception as e:
+                # The journal is still intact, so nothing is lost; try again next time
+                print(f"Error compacting data for guild {guild_id}: {e}")
+
+    def flush(self):
+        """Compact every loaded guild synchronously. Only call once the event loop has stopped."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending.update(g for g in self._leaderboards if self.backend.needs_flush(g))
+        pending, self._pending = self._pending, set()
+        for guild_id in pending:
+            try:
+                self.backend.compact(
+                    guild_id, self._leaderboards[guild_id], self._streaks[guild_id], self._archives[guild_id]
+                )
+            except Exception as e:
+                print(f"Error compacting data for guild {guild_id}: {e}")
+
+    def close(self):
+        self.flush()
+        self.backend.close()